@@ -1,15 +1,23 @@
 #define SAMPLE_RATE 512
 #define BAUD_RATE 115200
 #define NUM_INPUTS 3 // Number of analog input pins
+#define SYNC_WORD 0xA55A
 
 const uint8_t input_pins[NUM_INPUTS] = {36,39,34};
 
 bool reading = false;
+bool binary_mode = false;
+uint16_t sequence = 0;
 
 void setup() {
   Serial.begin(BAUD_RATE);
 }
 
+void write_uint16(uint16_t value) {
+  Serial.write((uint8_t)(value & 0xFF));
+  Serial.write((uint8_t)(value >> 8));
+}
+
 void loop() {
   if (Serial.available() > 0) {
     String command = Serial.readStringUntil('\n');
@@ -17,6 +25,11 @@ void loop() {
       reading = true;
     } else if (command == "stop_reading") {
       reading = false;
+    } else if (command == "binary_mode") {
+      binary_mode = true;
+      sequence = 0;
+    } else if (command == "text_mode") {
+      binary_mode = false;
     }
   }
 
@@ -32,15 +45,24 @@ void loop() {
     if (timer < 0) {
       timer += 1000000 / SAMPLE_RATE;
 
-      // Read and send data as a comma-separated array
-      for (int i = 0; i < NUM_INPUTS; i++) {
-        int sensor_value = analogRead(input_pin[i]);
-        Serial.print(sensor_value);
-        if (i < NUM_INPUTS - 1) {
-          Serial.print(","); // Add a comma between values
+      if (binary_mode) {
+        // Frame: sync word, sequence counter, one uint16 per input (little endian)
+        write_uint16(SYNC_WORD);
+        write_uint16(sequence++);
+        for (int i = 0; i < NUM_INPUTS; i++) {
+          write_uint16(analogRead(input_pins[i]));
+        }
+      } else {
+        // Read and send data as a comma-separated array
+        for (int i = 0; i < NUM_INPUTS; i++) {
+          int sensor_value = analogRead(input_pins[i]);
+          Serial.print(sensor_value);
+          if (i < NUM_INPUTS - 1) {
+            Serial.print(","); // Add a comma between values
+          }
         }
+        Serial.println(); // End the line after each set of readings
       }
-      Serial.println(); // End the line after each set of readings
     }
   }
 }
@@ -0,0 +1,118 @@
+import argparse
+import sys
+import threading
+import tracemalloc
+import numpy as np
+from services.data_preprocessor import PreprocessEEG
+from services.feature_selection import FeatureExtractor
+from services.stream_engine import RingBuffer, SlidingWindowEngine
+from services.synthetic_eeg import SyntheticEEG
+from benchmarks.signal_pipeline import fitted_predictor
+
+# Allocation check for the live prediction path: replays what a
+# PredictionSession does per headset block (clean, filter, ring buffer
+# write) and per window (window copy, features, scaling, predict) under
+# tracemalloc, and reports the memory allocated on top of what was already
+# live. Exits with status 1 when a window allocates more than
+# --max-window-bytes, e.g.
+#   python -m benchmarks.allocations --model artifact
+# Nothing runs this automatically; the budget is only checked when the
+# script is run by hand.
+# The "lists" row repeats the window measurement with calculate_features
+# and predict on Python lists, the path sessions used before.
+
+
+def session_steps(args, predictor):
+    n_channels = predictor.n_channels
+    preprocessor = PreprocessEEG(args.sampling_rate)
+    extractor = FeatureExtractor(args.sampling_rate)
+    n_samples = (2 * (args.windows + args.warmup) + 8) * args.hop + args.window
+    raw = SyntheticEEG(args.channels, args.sampling_rate, seed=args.seed).generate(n_samples)
+
+    buffer = RingBuffer(capacity=4 * args.window, channels=args.channels)
+    engine = SlidingWindowEngine(buffer, window=args.window, hop=args.hop)
+    windows = engine.windows(threading.Event())
+    features = np.empty((1, n_channels * len(extractor.COLUMNS)))
+    scaled = np.empty_like(features)
+    position = [0]
+
+    def block():
+        # One hop of samples, as read_block would hand them over
+        start = position[0]
+        position[0] += args.hop
+        buffer.write(preprocessor.preprocess_chunk(raw[:, start:start + args.hop]))
+
+    def window():
+        data = next(windows)
+        extractor.calculate_features_into(data[:n_channels], features[0])
+        return int(predictor.predict(features, out=scaled)[0])
+
+    def list_window():
+        data = next(windows)
+        feature, _ = extractor.calculate_features(data[:n_channels])
+        return int(predictor.predict([feature])[0])
+
+    # Fill the ring buffer up to the first window
+    for _ in range(-(-args.window // args.hop)):
+        block()
+    return block, window, list_window
+
+
+def measure(steps, calls):
+    # steps run in turn; for each, the bytes allocated during a call above
+    # what was live before it (transient peak), and the growth left behind
+    tracemalloc.start()
+    started = tracemalloc.get_traced_memory()[0]
+    peaks = {name: np.empty(calls) for name in steps}
+    for i in range(calls):
+        for name, step in steps.items():
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            step()
+            peaks[name][i] = tracemalloc.get_traced_memory()[1] - current
+    retained = tracemalloc.get_traced_memory()[0] - started
+    tracemalloc.stop()
+    return {name: {"median_bytes": float(np.median(values)), "max_bytes": float(values.max())}
+            for name, values in peaks.items()}, retained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--window", type=int, default=512)
+    parser.add_argument("--hop", type=int, default=128)
+    parser.add_argument("--sampling-rate", type=int, default=512)
+    parser.add_argument("--windows", type=int, default=200, help="windows to measure")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", choices=("sklearn", "artifact"), default="artifact")
+    parser.add_argument("--max-window-bytes", type=float, default=4096,
+                        help="allowed median allocation per window")
+    args = parser.parse_args()
+
+    predictor = fitted_predictor(args.channels, args.window, args.sampling_rate, args.model)
+    results = {}
+    for name, list_path in (("ndarray", False), ("lists", True)):
+        block, window, list_window = session_steps(args, predictor)
+        step = list_window if list_path else window
+        # Warm up the workspaces and buffers first; steady state is what counts
+        for _ in range(args.warmup):
+            block()
+            step()
+        measured, retained = measure({"block": block, "window": step}, args.windows)
+        for step_name, result in measured.items():
+            results[f"{name} {step_name}"] = result
+        print(f"{name}: {retained:.0f} bytes retained after {args.windows} windows")
+
+    print(f"{'step':<16}{'median B':>12}{'max B':>12}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['median_bytes']:>12.0f}{result['max_bytes']:>12.0f}")
+
+    allocated = results["ndarray window"]["median_bytes"]
+    if allocated > args.max_window_bytes:
+        print(f"Windows allocate {allocated:.0f} bytes, more than {args.max_window_bytes:.0f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import os
+import time
+from pymongo import MongoClient, AsyncMongoClient
+
+# Compares blocking pymongo calls made on the event loop (what the route
+# handlers used to do) with the async data-access layer, under concurrent
+# load against a local MongoDB, e.g.
+#   docker run --rm -p 27017:27017 mongo
+#   python -m benchmarks.db_throughput --requests 5000 --concurrency 100
+
+
+async def measure_loop_lag(stop, lags):
+    # Records how late a 10 ms timer fires; a blocked event loop shows up
+    # as large lags for every other client.
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def run(name, handler, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(i)
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+
+    latencies.sort()
+    lags.sort()
+    print(f"{name:>6}: {requests / elapsed:8.0f} req/s  "
+          f"p50 {latencies[len(latencies) // 2] * 1000:7.2f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms  "
+          f"max loop lag {lags[-1] * 1000 if lags else 0:7.2f} ms")
+
+
+async def main(args):
+    sync_client = MongoClient(args.uri, maxPoolSize=args.pool_size)
+    async_client = AsyncMongoClient(args.uri, maxPoolSize=args.pool_size)
+    sync_users = sync_client[args.db]["users"]
+    async_users = async_client[args.db]["users"]
+
+    sync_users.drop()
+    sync_users.insert_many([{"email": f"user{i}@example.com", "model_trained": False} for i in range(args.users)])
+    sync_users.create_index("email", unique=True)
+
+    async def sync_handler(i):
+        sync_users.find_one({"email": f"user{i % args.users}@example.com"})
+
+    async def async_handler(i):
+        await async_users.find_one({"email": f"user{i % args.users}@example.com"})
+
+    try:
+        await run("sync", sync_handler, args.requests, args.concurrency)
+        await run("async", async_handler, args.requests, args.concurrency)
+    finally:
+        sync_client.drop_database(args.db)
+        sync_client.close()
+        await async_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MongoDB access throughput under concurrent load")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--db", default="bci_benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=int(os.environ.get("MONGO_MAX_POOL_SIZE", 100)))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+import argparse
+import subprocess
+import sys
+import time
+from services.eeg_collect import SensorReader
+from services.prediction_session import SessionManager, PREDICTION_HOP, PREDICTION_WINDOW
+from benchmarks.signal_pipeline import fitted_predictor
+
+# Runs increasing numbers of prediction sessions against virtual headsets
+# (services.virtual_device, started in a separate process so it does not
+# compete for this process's GIL) to find where the backend stops keeping
+# up, e.g.
+#   python -m benchmarks.session_load --sessions 1 8 16 32 64 --duration 20
+# A step keeps up when every session produces its expected predictions per
+# second and the sliding window engine neither lags nor skips windows.
+
+
+def start_device(args, headsets):
+    command = [sys.executable, "-m", "services.virtual_device", "--pty", str(headsets),
+               "--source", args.source, "--channels", str(args.channels), "--speed", str(args.speed)]
+    device = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    ports = []
+    while len(ports) < headsets:
+        line = device.stdout.readline()
+        if not line:
+            raise RuntimeError("Virtual device exited before creating its headsets")
+        if line.startswith("Virtual headset"):
+            ports.append(line.rsplit(": ", 1)[1].strip())
+    return device, ports
+
+
+def run_step(args, ports, predictor, n_sessions):
+    manager = SessionManager()
+    sessions = []
+    for i, port in enumerate(ports[:n_sessions]):
+        reader = SensorReader(port=port, channels=args.channels, binary=args.binary)
+        session = manager.open(f"load{i}@example.com", reader, predictor)
+        if session is None:
+            raise RuntimeError(f"Could not open {port}")
+        session.start()
+        sessions.append(session)
+
+    # Let the filters and the first windows settle before measuring
+    time.sleep(args.warmup)
+    before = [session.stats() for session in sessions]
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    max_lag = 0
+    while time.perf_counter() - started < args.duration:
+        time.sleep(0.5)
+        max_lag = max([max_lag] + [session.engine.lag() for session in sessions])
+    elapsed = time.perf_counter() - started
+    cpu = (time.process_time() - cpu_started) / elapsed
+    after = [session.stats() for session in sessions]
+    manager.close_all()
+
+    rates = [(a["predictions"] - b["predictions"]) / elapsed for a, b in zip(after, before)]
+    expected = args.speed / PREDICTION_HOP
+    skipped = sum(a["windows_skipped"] - b["windows_skipped"] for a, b in zip(after, before))
+    dropped = sum(a["dropped_samples"] - b["dropped_samples"] for a, b in zip(after, before))
+    lag_ms = max_lag / args.speed / sessions[0].sensor_reader.FREQ * 1000
+    keeps_up = min(rates) >= 0.95 * expected and not skipped
+    print(f"{n_sessions:4d} sessions: {sum(rates):8.1f} predictions/s (min {min(rates):5.2f}/s per session, "
+          f"expected {expected:5.2f})  max lag {lag_ms:7.1f} ms  skipped {skipped:5d}  dropped {dropped:5d}  "
+          f"cpu {cpu * 100:6.1f}%  {'ok' if keeps_up else 'SATURATED'}")
+    return keeps_up
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds measured per step")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--speed", type=float, default=1.0, help="device speed; 2 doubles the sample rate")
+    parser.add_argument("--source", default="synthetic")
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--model", choices=("sklearn", "artifact"), default="artifact")
+    parser.add_argument("--keep-going", action="store_true", help="run all steps after saturation")
+    args = parser.parse_args()
+
+    predictor = fitted_predictor(args.channels, int(PREDICTION_WINDOW * 512), 512, args.model)
+    device, ports = start_device(args, max(args.sessions))
+    try:
+        for n_sessions in sorted(args.sessions):
+            if not run_step(args, ports, predictor, n_sessions) and not args.keep_going:
+                break
+    finally:
+        device.terminate()
+        device.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import scipy
+import sklearn
+from sklearn.svm import SVC
+from sklearn.preprocessing import StandardScaler
+from services.data_preprocessor import PreprocessEEG
+from services.feature_selection import FeatureExtractor
+from services.model_artifact import ArtifactModel, export_model
+from services.model_predict import ModelPredict
+from services.synthetic_eeg import SyntheticEEG, labelled_windows
+
+# Per-stage latency, throughput and allocations of the signal path on
+# synthetic EEG, e.g.
+#   python -m benchmarks.signal_pipeline --channels 3 --window 512 --save baseline.json
+#   (change something)
+#   python -m benchmarks.signal_pipeline --channels 3 --window 512 --compare baseline.json
+# --compare exits with status 1 when a stage's p50 got slower than
+# --threshold, so it can gate a CI job.
+
+PERCENTILES = (50, 90, 99)
+
+
+def fitted_predictor(channels, window, sampling_rate, svm):
+    preprocessor = PreprocessEEG(sampling_rate)
+    extractor = FeatureExtractor(sampling_rate)
+    windows, labels = labelled_windows(200, window, channels, sampling_rate, seed=1)
+    features = extractor.calculate_features_batch(preprocessor.preprocess(windows))
+    scaler = StandardScaler().fit(features)
+    model = SVC(kernel='rbf', C=10).fit(scaler.transform(features), labels)
+
+    predictor = ModelPredict()
+    predictor.scaler = scaler
+    if svm == "artifact":
+        spec, arrays = export_model(model, scaler)
+        predictor.model = ArtifactModel(spec, arrays)
+    else:
+        predictor.model = model
+    return predictor
+
+
+def build_stages(args):
+    preprocessor = PreprocessEEG(args.sampling_rate)
+    streaming = PreprocessEEG(args.sampling_rate)
+    extractor = FeatureExtractor(args.sampling_rate)
+    predictor = fitted_predictor(args.channels, args.window, args.sampling_rate, args.model)
+
+    windows = SyntheticEEG(args.channels, args.sampling_rate, seed=args.seed).windows(args.windows, args.window)
+    filtered = preprocessor.preprocess(windows)
+    features = extractor.calculate_features_batch(filtered)
+
+    def end_to_end(i):
+        feature_row = extractor.calculate_features_batch(preprocessor.preprocess(windows[i:i + 1]))
+        return predictor.predict(feature_row)
+
+    # name -> (function of the window index, windows handled per call)
+    return windows, {
+        "clean_data": (lambda i: preprocessor.clean_data(windows[i]), 1),
+        "preprocess": (lambda i: preprocessor.preprocess(windows[i]), 1),
+        "preprocess_chunk": (lambda i: streaming.preprocess_chunk(windows[i]), 1),
+        "calculate_features": (lambda i: extractor.calculate_features(filtered[i]), 1),
+        "calculate_features_batch": (lambda i: extractor.calculate_features_batch(filtered), len(windows)),
+        "predict": (lambda i: predictor.predict(features[i:i + 1]), 1),
+        "end_to_end": (end_to_end, 1),
+    }
+
+
+def time_stage(function, n_windows, repeat, warmup):
+    for i in range(warmup):
+        function(i % n_windows)
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        started = time.perf_counter_ns()
+        function(i % n_windows)
+        timings[i] = time.perf_counter_ns() - started
+    return timings / 1000  # microseconds
+
+
+def trace_stage(function, n_windows, calls):
+    # Separate pass, since tracing slows every allocation down
+    tracemalloc.start()
+    peaks = []
+    blocks = []
+    for i in range(calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot() if i == 0 else None
+        result = function(i % n_windows)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        if before is not None:
+            # Blocks still alive after the call: the result and anything cached
+            blocks = tracemalloc.take_snapshot().compare_to(before, "filename")
+        del result
+    tracemalloc.stop()
+    return {
+        "peak_kib": float(np.median(peaks)) / 1024,
+        "retained_kib": sum(stat.size_diff for stat in blocks) / 1024,
+        "allocated_blocks": sum(max(0, stat.count_diff) for stat in blocks),
+    }
+
+
+def run(args):
+    windows, stages = build_stages(args)
+    results = {}
+    for name, (function, per_call) in stages.items():
+        if args.stages and name not in args.stages:
+            continue
+        repeat = max(3, args.repeat // per_call) if per_call > 1 else args.repeat
+        timings = time_stage(function, len(windows), repeat, args.warmup)
+        result = {f"p{p}_us": float(np.percentile(timings, p)) for p in PERCENTILES}
+        result["max_us"] = float(timings.max())
+        result["windows_per_s"] = per_call * repeat / (timings.sum() / 1e6)
+        result.update(trace_stage(function, len(windows), min(20, repeat)))
+        results[name] = result
+        print(f"{name:>24}: p50 {result['p50_us']:9.1f} us  p99 {result['p99_us']:9.1f} us  "
+              f"{result['windows_per_s']:10.0f} windows/s  peak {result['peak_kib']:8.1f} KiB")
+    return results
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "sklearn": sklearn.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "config": {key: getattr(args, key) for key in ("channels", "window", "sampling_rate", "windows",
+                                                      "repeat", "seed", "model")},
+    }
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline["environment"]["config"] != results["environment"]["config"]:
+        print("Warning: baseline was recorded with a different configuration")
+    print(f"\nAgainst {baseline_path} (commit {baseline['environment'].get('commit')}):")
+    regressions = []
+    for name, result in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        ratio = result["p50_us"] / before["p50_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:>24}: p50 x{ratio:5.2f}  peak {before['peak_kib']:8.1f} -> {result['peak_kib']:8.1f} KiB{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--window", type=int, default=512)
+    parser.add_argument("--sampling-rate", type=int, default=512)
+    parser.add_argument("--windows", type=int, default=64, help="distinct synthetic windows to cycle through")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", choices=("sklearn", "artifact"), default="artifact")
+    parser.add_argument("--stages", nargs="*")
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p50 slowdown, e.g. 0.10 for 10%%")
+    args = parser.parse_args()
+
+    results = {"environment": environment(args), "stages": run(args)}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,108 @@
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, AsyncMongoClient, ASCENDING, errors
 import os
 
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_DB = os.environ.get('MONGO_DB', 'bci')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+
+# Created at startup; create_index is a no-op for indexes that already exist.
+# (email, label) also serves queries on email alone, and (email, session_id)
+# the per-session reads of online model updates.
+INDEXES = [
+    ("users", [("email", ASCENDING)], {"unique": True}),
+    ("eeg_data", [("email", ASCENDING), ("label", ASCENDING)], {}),
+    ("eeg_data", [("email", ASCENDING), ("session_id", ASCENDING)], {}),
+]
+
+
 class Database:
+    # Blocking client for worker threads (data collection, training)
     def __init__(self):
-        self.client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'))
-        self.db = self.client[os.environ.get('MONGO_DB', 'bci')]
+        self.client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+        self.db = self.client[MONGO_DB]
 
     def get_collection(self, collection_name):
         return self.db[collection_name]
-    
-    
+
+
     def close(self):
         self.client.close()
 
-db_instance = Database()
\ No newline at end of file
+
+class AsyncDatabase:
+    # Non-blocking client for route handlers running on the event loop
+    def __init__(self):
+        self.client = AsyncMongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+        self.db = self.client[MONGO_DB]
+
+    def get_collection(self, collection_name):
+        return self.db[collection_name]
+
+    async def ensure_indexes(self):
+        # Failures are reported but not fatal, e.g. existing duplicate
+        # emails make the unique index fail until they are cleaned up
+        for collection_name, keys, options in INDEXES:
+            try:
+                name = await self.db[collection_name].create_index(keys, **options)
+                print(f"Index {collection_name}.{name} ready")
+            except errors.PyMongoError as e:
+                print(f"Could not create index on {collection_name} {keys}: {e}")
+
+    async def close(self):
+        await self.client.close()
+
+
+class UserRepository:
+    def __init__(self, database):
+        self.collection = database.get_collection("users")
+        # Called with the email after every write, e.g. to drop cached state
+        self.listeners = []
+
+    def changed(self, email):
+        for listener in self.listeners:
+            listener(email)
+
+    async def find_by_email(self, email, projection=None):
+        return await self.collection.find_one({"email": email}, projection)
+
+    async def exists(self, email):
+        return await self.collection.find_one({"email": email}, {"_id": 1}) is not None
+
+    async def create(self, user):
+        result = await self.collection.insert_one(user)
+        self.changed(user["email"])
+        return result
+
+    async def set_fields(self, email, fields):
+        result = await self.collection.update_one({"email": email}, {"$set": fields})
+        self.changed(email)
+        return result
+
+    async def unset_fields(self, email, *fields):
+        result = await self.collection.update_one({"email": email}, {"$unset": {field: "" for field in fields}})
+        self.changed(email)
+        return result
+
+
+class EEGRepository:
+    def __init__(self, database):
+        self.collection = database.get_collection("eeg_data")
+
+    async def insert(self, document):
+        return await self.collection.insert_one(document)
+
+    async def count(self, email, label=None):
+        query = {"email": email}
+        if label is not None:
+            query["label"] = label
+        return await self.collection.count_documents(query)
+
+    def find_by_email(self, email, projection=None, batch_size=1000):
+        return self.collection.find({"email": email}, projection, batch_size=batch_size)
+
+
+db_instance = Database()
+async_db_instance = AsyncDatabase()
+users_repository = UserRepository(async_db_instance)
+eeg_repository = EEGRepository(async_db_instance)
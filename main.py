@@ -1,9 +1,16 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import users
 from routes import model_training
 from routes import model_prediction
-from database import db_instance
+from database import db_instance, async_db_instance
+from services.prediction_session import session_manager
+from services.training_jobs import training_scheduler
+from utils import metrics
+from utils.auth import AuthError
+from utils.send_email import email_dispatcher
 
 app = FastAPI()
 origins = ["http://localhost:3000"]
@@ -16,9 +23,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
     
+@app.exception_handler(AuthError)
+async def auth_error_handler(request: Request, exc: AuthError):
+    # Same shape and status as the checks the routes used to do inline
+    return JSONResponse({"status":"error","message":exc.message})
+
+@app.on_event("startup")
+async def startup():
+    # In the background, so the API still comes up while MongoDB is down
+    app.state.index_task = asyncio.create_task(async_db_instance.ensure_indexes())
+
 @app.on_event("shutdown")
 async def shutdown():
+    session_manager.close_all()
+    model_training.eeg_writer.close()
+    training_scheduler.shutdown()
+    await email_dispatcher.close()
     db_instance.close()    
+    await async_db_instance.close()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        return PlainTextResponse("Metrics are disabled\n", status_code=404)
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 app.include_router(users.router,prefix="/users",tags=["users"])
 app.include_router(model_training.router,prefix="/model-training",tags=["model-training"])
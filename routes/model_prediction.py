@@ -1,30 +1,31 @@
-from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
-from database import db_instance
-from utils.hash_helper import decode_token
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect, Depends
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from utils.auth import AuthError, auth_cache, current_email, current_user
+from utils.constants import COM_PORT, EEG_PORTS, EEG_CHANNELS, EEG_BINARY_FRAMES
 from services.eeg_collect import SensorReader
-from services.model_predict import ModelPredict
-from services.feature_selection import FeatureExtractor
-from services.data_preprocessor import PreprocessEEG
-import time
-import threading 
-from queue import Queue
+from services.model_registry import model_registry
+from services.prediction_session import session_manager, PREDICTION_WINDOW
+from services.batch_scoring import BatchScorer, parser_for
+from utils.metrics import stage_seconds
 import asyncio
-import os
-from threading import Event
-
-prediction_queue = Queue()
-is_predicting = False
-stop_event = Event()
-thread = None
-
+import json
+import time
 
 
 router = APIRouter()
-collection = db_instance.get_collection("users")
 
-COM_PORT = os.environ.get("COM_PORT")
-sensor_reader = SensorReader(port=COM_PORT)
-model = ModelPredict()
+
+class UploadStreamingResponse(StreamingResponse):
+    # StreamingResponse normally listens for the client disconnecting by
+    # reading from the request, which would swallow the upload the body
+    # generator is still reading; here the generator's own reads notice the
+    # disconnect instead.
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            pass
 
 
 @router.get("/")
@@ -33,96 +34,159 @@ async def test_model_training():
 
 
 @router.post("/connect-egg")
-async def connect_eeg(request:Request):
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
-    user = collection.find_one({"email":token_status["email"]})
-    if not user:
-        return {"status":"error","message":"User not found"}
+async def connect_eeg(request:Request, user: dict = Depends(current_user)):
     if not user.get("model_trained"):
         return {"status":"error","message":"Model not trained"}
-    sensor_connected = sensor_reader.connect()
-    if not sensor_connected:
+    # Each headset gets its own serial port, one of EEG_PORTS; COM_PORT is
+    # the default
+    port = request.query_params.get("port", COM_PORT)
+    if port not in EEG_PORTS:
+        return {"status":"error","message":"Invalid port"}
+    try:
+        model = model_registry.get(user["email"])
+    except FileNotFoundError:
+        return {"status":"error","message":"Model not found"}
+
+    sensor_reader = SensorReader(port=port, channels=EEG_CHANNELS, binary=EEG_BINARY_FRAMES)
+    session = await asyncio.to_thread(session_manager.open, user["email"], sensor_reader, model)
+    if not session:
         return {"status":"error","message":"Failed to connect to EEG"}
-    
-    model.load_model(email=token_status["email"])
-    sensor_reader.start_reading()
     return {"status":"success","message":"Connected to EEG"}
 
 @router.post("/disconnect-egg")
-async def disconnect_eeg(request:Request):
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
-    user = collection.find_one({"email":token_status["email"]})
-    if not user:
-        return {"status":"error","message":"User not found"}
-    sensor_reader.stop_reading()
-    sensor_reader.disconnect()
+async def disconnect_eeg(user: dict = Depends(current_user)):
+    await asyncio.to_thread(session_manager.close, user["email"])
 
     return {"status":"success","message":"Disconnected from EEG"}
 
-    
-def prediction_worker():
-    global is_predicting
-    
-    preprocessor = PreprocessEEG()
-    feature_extractor = FeatureExtractor()
-    
-    while is_predicting:
+@router.post("/score")
+async def score_recording(request: Request, user: dict = Depends(current_user)):
+    # The recording is the raw request body (curl --data-binary @eeg_data.csv
+    # -H "Content-Type: text/csv", or a .npy with application/octet-stream),
+    # read and scored chunk by chunk. Results are streamed back as NDJSON,
+    # one line per window followed by a summary (or error) line.
+    if not user.get("model_trained"):
+        return {"status":"error","message":"Model not trained"}
+    try:
+        model = model_registry.get(user["email"])
+    except FileNotFoundError:
+        return {"status":"error","message":"Model not found"}
+
+    try:
+        sampling_rate = int(request.query_params.get("sampling_rate", 512))
+        window = float(request.query_params.get("window", PREDICTION_WINDOW))  # seconds
+        hop = float(request.query_params.get("hop", window))  # seconds
+    except ValueError:
+        return {"status":"error","message":"Invalid window parameters"}
+    if sampling_rate <= 0 or window <= 0 or hop <= 0:
+        return {"status":"error","message":"Invalid window parameters"}
+
+    content_type = request.query_params.get("format") or request.headers.get("content-type", "")
+    parser = parser_for(content_type, request.query_params.get("filename", ""))
+    try:
+        scorer = BatchScorer(model, sampling_rate=sampling_rate, window=int(window * sampling_rate),
+                             hop=max(1, int(hop * sampling_rate)))
+    except ValueError as e:
+        return {"status":"error","message":f"Invalid window parameters: {e}"}
+
+    def process(chunk):
+        return scorer.feed(parser.feed(chunk))
+
+    def finish():
+        return scorer.feed(parser.finish()) + scorer.finish()
+
+    async def results():
         try:
-            predictions = []
-            for _ in range(5):
-                generator_data = sensor_reader.read_one_second_data()
-                data = list(next(generator_data, []))
-                data = preprocessor.preprocess(data)
-                feature, _ = feature_extractor.calculate_features(data)
-                prediction = model.predict([feature])
-                predictions.append(prediction)
-                time.sleep(1)
-            
-            prediction = None
-            if predictions.count(0) > predictions.count(1):
-                prediction = 0
-            else:
-               prediction = 1
-                
-            prediction_text = "Relaxing" if prediction == 0 else "Focused"
-
-            # Add prediction to the queue
-            prediction_queue.put(prediction_text)
+            async for chunk in request.stream():
+                if chunk:
+                    lines = await asyncio.to_thread(process, chunk)
+                    if lines:
+                        yield "".join(json.dumps(line) + "\n" for line in lines)
+            lines = await asyncio.to_thread(finish)
+            if lines:
+                yield "".join(json.dumps(line) + "\n" for line in lines)
+            summary = {"status":"success","message":"Recording scored","data":scorer.summary()}
+        except ValueError as e:
+            summary = {"status":"error","message":f"Invalid recording: {e}"}
+        except ClientDisconnect:
+            print(f"Client disconnected while scoring a recording for {user['email']}")
+            return
         except Exception as e:
-            print(f"Error in prediction pipeline: {e}")
-            break
+            # Still end the stream with an error line the client can read
+            print(f"Scoring failed for {user['email']}: {e}")
+            summary = {"status":"error","message":"Scoring failed"}
+        yield json.dumps(summary) + "\n"
+
+    return UploadStreamingResponse(results(), media_type="application/x-ndjson")
 
-    is_predicting = False
-    print("Stopped prediction pipeline")
+@router.get("/sessions")
+async def prediction_sessions(email: str = Depends(current_email)):
+    # Totals over all sessions, details only for the caller's own
+    data = session_manager.stats()
+    del data["details"]
+    session = session_manager.get(email)
+    data["session"] = session.stats() if session else None
+    return {"status":"success","message":"Active prediction sessions","data":data}
 
 
 @router.websocket("/ws/predict")
 async def websocket_endpoint(websocket: WebSocket):
-    global is_predicting
-    stop_event.clear()
     await websocket.accept()
     try:
-        is_predicting = True
-        thread = threading.Thread(target=prediction_worker).start()
+        email = auth_cache.verify(websocket.cookies.get("access_token"))
+    except AuthError as e:
+        await websocket.send_text(e.message)
+        await websocket.close()
+        return
+    session = session_manager.get(email)
+    if not session:
+        await websocket.send_text("EEG not connected")
+        await websocket.close()
+        return
+
+    if not session.attach(asyncio.get_running_loop()):
+        # Another socket is already reading this session's predictions;
+        # it alone may end the session
+        await websocket.send_text("Prediction stream already open")
+        await websocket.close(code=4409)
+        return
 
-        while is_predicting:
-            await asyncio.sleep(0.1)  # Check queue periodically
-            if not prediction_queue.empty():
-                prediction_text = prediction_queue.get()
-                await websocket.send_text(prediction_text)
+    try:
+        session.start()
+
+        # Wait on the next prediction and on the client at the same time, so
+        # predictions are sent as soon as they exist and a disconnect stops
+        # the session immediately.
+        receiver = asyncio.create_task(websocket.receive())
+        getter = asyncio.create_task(session.outputs.get())
+        send_seconds = stage_seconds.labels(pipeline="prediction", stage="websocket_send")
+        try:
+            while True:
+                done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    if receiver.result()["type"] == "websocket.disconnect":
+                        print("WebSocket disconnected")
+                        break
+                    receiver = asyncio.create_task(websocket.receive())
+                if getter in done:
+                    prediction_text = getter.result()
+                    if prediction_text is None:
+                        break
+                    started = time.perf_counter()
+                    await websocket.send_text(prediction_text)
+                    send_seconds.observe(time.perf_counter() - started)
+                    getter = asyncio.create_task(session.outputs.get())
+        finally:
+            receiver.cancel()
+            getter.cancel()
 
     except WebSocketDisconnect:
         print("WebSocket disconnected")
-        is_predicting = False
     except Exception as e:
         print(f"WebSocket error: {e}")
-        is_predicting = False
     finally:
-        stop_event.set()
-        sensor_reader.stop_reading()
-        sensor_reader.disconnect()
-        await websocket.close()        
\ No newline at end of file
+        await asyncio.to_thread(session_manager.close, email, session)
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
@@ -1,23 +1,44 @@
-from fastapi import APIRouter,Request
+from fastapi import APIRouter,Request,Depends
+from fastapi.responses import StreamingResponse
 import threading
-from services.model_trainer import Model
+from services.model_trainer import Model, MODEL_TUNING
 from services.data_preprocessor import PreprocessEEG
 from services.feature_selection import FeatureExtractor
 from services.eeg_collect import SensorReader
-from utils.hash_helper import decode_token
-from utils.constants import state_to_label,state_to_database
-from database import db_instance
+from services.model_registry import model_registry
+from services.eeg_writer import BatchedWriter, EEG_FLUSH_TIMEOUT
+from services.raw_archive import RawArchiveWriter
+from services.training_jobs import training_scheduler
+from services.online_model import OnlineModel
+from services.dataset_export import EXPORT_FORMATS, parquet_available, load_training_set
+from utils.auth import auth_cache, current_email, current_user, USER_STATE_PROJECTION
+from utils.constants import state_to_label,state_to_database,COM_PORT,EEG_CHANNELS,EEG_BINARY_FRAMES
+from database import db_instance, users_repository
+from utils.metrics import registry, stage_seconds, samples_total, windows_total, record_device_counters
+import asyncio
+import uuid
+import time
+import os
 
 collection = db_instance.get_collection("users")
 eeg_collection = db_instance.get_collection("eeg_data")
+eeg_writer = BatchedWriter(eeg_collection)
+registry.gauge("bci_eeg_writer_queue", "Feature documents waiting to be written to MongoDB",
+               lambda: eeg_writer.queue.qsize())
+RAW_ARCHIVE_ENABLED = os.environ.get("RAW_ARCHIVE_ENABLED", "1") == "1"
 
 
 current_data_state = {
     "state": "",
     "time": 0,
-    "isRunning": False
+    "isRunning": False,
+    "session_id": None
 }
 
+# Users whose online model update is running; checked and changed on the
+# event loop only
+updating = set()
+
 stop_event = threading.Event()
 thread = None
 
@@ -32,7 +53,7 @@ def model_training_pipeline(email):
     model = Model()
     print("Model training started")
 
-    user_data = collection.find_one({"email":email})
+    user_data = collection.find_one({"email":email},USER_STATE_PROJECTION)
     if not user_data:
         return {"status":"error","message":"User not found"}
     if user_data.get("model_trained"):
@@ -40,54 +61,134 @@ def model_training_pipeline(email):
     if not user_data.get("focused_data_collected") or not user_data.get("relaxed_data_collected"):
         return {"status":"error","message":"Data not collected"}
     
-    data = eeg_collection.find({"email":email})
-    
-    X = []
-    y = []
-    for record in data:
-        X.append(record["features"])
-        y.append(record["label"])
+    X, y = load_training_set(eeg_collection, {"email":email})
     print(len(X))
     print(y)    
-    model.train_with_split(X,y)
+    if MODEL_TUNING:
+        print(model.tune(X,y))
+    else:
+        model.train_with_split(X,y)
     print("Model trained")
     print(model.evaluate(X,y))
     model.save_model(email=email)
     print("Model saved")
     collection.update_one({"email":email},{"$set":{"model_trained":True}})
     return {"status":"success","message":"Model trained successfully"}
+
+def model_update_pipeline(email, session_id=None, convert=False):
+    # Folds the windows of one collection session into the user's online
+    # model. Only the first update, which starts the online model, reads
+    # the user's full history; replacing a batch-trained model that way has
+    # to be asked for with convert.
+    user_data = collection.find_one({"email":email},{**USER_STATE_PROJECTION,"last_session_id":1})
+    if not user_data:
+        return {"status":"error","message":"User not found"}
+    if not user_data.get("focused_data_collected") or not user_data.get("relaxed_data_collected"):
+        return {"status":"error","message":"Data not collected"}
+    # Defaults to the user's most recent collection session
+    session_id = session_id or user_data.get("last_session_id")
+
+    online_model = OnlineModel.load_model(email)
+    if online_model and session_id in online_model.metadata.get("sessions", []):
+        return {"status":"error","message":"Session already used for an update"}
+    converted = online_model is None and bool(user_data.get("model_trained"))
+    if converted and not convert:
+        return {"status":"error","message":"Model is batch trained; pass convert to replace it with an online model"}
+    # Make sure windows still buffered by the writer are in the database
+    if not eeg_writer.flush(timeout=EEG_FLUSH_TIMEOUT):
+        print(f"EEG writer flush timed out; updating {email} without the windows still queued")
+    if online_model is None:
+        online_model = OnlineModel()
+        query = {"email":email}
+    else:
+        if not session_id:
+            return {"status":"error","message":"No new session to learn from"}
+        query = {"email":email,"session_id":session_id}
+
+    X, y = load_training_set(eeg_collection, query)
+    if not len(X):
+        return {"status":"error","message":"No data found for update"}
+
+    metadata = online_model.update(X,y)
+    if session_id:
+        metadata.setdefault("sessions", []).append(session_id)
+    online_model.save_model(email=email)
+    model_registry.invalidate(email)
+    collection.update_one({"email":email},{"$set":{"model_trained":True}})
+    auth_cache.invalidate(email)
+    if converted:
+        return {"status":"success","message":"Batch model replaced with an online model","converted":True,
+                "metadata":metadata}
+    return {"status":"success","message":"Model updated successfully","converted":False,"metadata":metadata}
     
 def start_eeg_pipeline(email: str):
-    sensor_reader = SensorReader()
+    sensor_reader = SensorReader(port=COM_PORT, channels=EEG_CHANNELS, binary=EEG_BINARY_FRAMES)
     preprocessor = PreprocessEEG()
     feature_extractor = FeatureExtractor()
 
     global current_data_state
-    sensor_reader.connect()
+    if not sensor_reader.connect():
+        current_data_state["isRunning"] = False
+        return {"status": "error", "message": "Failed to connect to EEG"}
     sensor_reader.start_reading()
+    generator_data = sensor_reader.read_one_second_data()
+    
+    # Raw samples are kept so features can be recomputed without recording again
+    session_id = current_data_state["session_id"]
+    archive = None
+    if RAW_ARCHIVE_ENABLED:
+        archive = RawArchiveWriter(email, current_data_state["state"], sensor_reader.channels, sensor_reader.FREQ,
+                                   session_id=session_id)
+    
+    stage_timers = {stage: stage_seconds.labels(pipeline="collection", stage=stage)
+                    for stage in ("serial_read", "archive", "preprocess", "features", "enqueue")}
+    samples = samples_total.labels(pipeline="collection")
+    windows = windows_total.labels(pipeline="collection")
+    reported = {}
     
     while current_data_state["isRunning"]:
-        generator_data = sensor_reader.read_one_second_data()
-        data = list(next(generator_data, []))
-        print(data)
-        if not data:
-            continue
-        preprocessed_data = preprocessor.preprocess(data)
+        started = time.perf_counter()
+        data = next(generator_data, None)
+        stage_timers["serial_read"].observe(time.perf_counter() - started)
+        if data is None:
+            # Port closed; the reader has nothing more to give
+            break
+        samples.inc(data.shape[1])
+        if archive:
+            started = time.perf_counter()
+            archive.write(data)
+            stage_timers["archive"].observe(time.perf_counter() - started)
+        # Same causal filtering as live prediction, continuous across windows
+        started = time.perf_counter()
+        preprocessed_data = preprocessor.preprocess_chunk(data)
+        stage_timers["preprocess"].observe(time.perf_counter() - started)
+        started = time.perf_counter()
         feature,_ = feature_extractor.calculate_features(preprocessed_data)
+        stage_timers["features"].observe(time.perf_counter() - started)
+        windows.inc()
+        record_device_counters("collection", sensor_reader, preprocessor, reported)
         
         
         data_to_store = {
             "email": email,
             "features": feature,
             "label": state_to_label[current_data_state["state"]],
+            "session_id": session_id,
         }
         
-        eeg_collection.insert_one(data_to_store)
-        print(data)
+        # Written in batches by a background thread, so database latency
+        # never stalls the serial reads
+        started = time.perf_counter()
+        eeg_writer.put(data_to_store)
+        stage_timers["enqueue"].observe(time.perf_counter() - started)
         print(feature)
                 
     sensor_reader.stop_reading()
     sensor_reader.disconnect()
+    if archive:
+        archive.close()
+    if not eeg_writer.flush(timeout=EEG_FLUSH_TIMEOUT):
+        print(f"EEG writer flush timed out after collection for {email}")
     
     return {"status": "success", "message": "Data collection Stopped"}
 
@@ -102,40 +203,39 @@ def stop_eeg_pipeline():
     stop_event.set()
     return {"status": "success", "message": "Data collection Stopped"}
 
+def training_finished(job):
+    model_registry.invalidate(job.email)
+    auth_cache.invalidate(job.email)
+
 @router.post("/check-model-status")
-async def check_model_status(request:Request):
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
-    
-    user = collection.find_one({"email":token_status["email"]})
-    if not user:
-        return {"status":"error","message":"User not found"}
+async def check_model_status(user: dict = Depends(current_user)):
+    job = training_scheduler.status(user["email"])
+    if job and job["status"] in ("queued", "running"):
+        return {"status":"error","message":"Model training in progress","job":job}
     if user.get("model_trained"):
-        return {"status":"success","message":"Model trained"}
-    return {"status":"error","message":"Model not trained"}
+        return {"status":"success","message":"Model trained","job":job}
+    if job and job["status"] == "failed":
+        return {"status":"error","message":f"Model training failed: {job['error']}","job":job}
+    return {"status":"error","message":"Model not trained","job":job}
+
+@router.post("/training-status")
+async def training_status(email: str = Depends(current_email)):
+    job = training_scheduler.status(email)
+    if not job:
+        return {"status":"error","message":"No training job found"}
+    return {"status":"success","message":f"Model training {job['status']}","job":job}
 
 @router.post("/check-data-status")
-async def check_data_status(request:Request):
-    token_status = decode_token(request.cookies.get("access_token"))
+async def check_data_status(request:Request, user: dict = Depends(current_user)):
     data = await request.json()
     state = data["state"]
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
-    
-    user = collection.find_one({"email":token_status["email"]})
-    if not user:
-        return {"status":"error","message":"User not found"}
     if user.get(state_to_database[state]):
         return {"status":"success","message":"Data collected"}
     return {"status":"error","message":"Data not collected"}
 
 @router.post("/start-collection")
-async def start_eeg_collection(request:Request):
+async def start_eeg_collection(request:Request, email: str = Depends(current_email)):
     data = await request.json()
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
     if not data.get("time") or not data.get("state"):
         return {"status":"error","message":"Invalid request"}
     current_state = data.get("state")
@@ -143,17 +243,16 @@ async def start_eeg_collection(request:Request):
     current_data_state["state"] = current_state
     current_data_state["time"] = time
     current_data_state["isRunning"] = True
+    current_data_state["session_id"] = uuid.uuid4().hex
+    # Kept per user, so /update-model defaults to the caller's own session
+    await users_repository.set_fields(email,{"last_session_id":current_data_state["session_id"]})
     
-    
-    thread = start_eeg_pipeline_with_thread(token_status["email"])
+    thread = start_eeg_pipeline_with_thread(email)
     return {"status":"success","message":"Data collection started"}
     
 @router.post("/stop-collection")
-async def stop_eeg_collection(request:Request):
+async def stop_eeg_collection(request:Request, email: str = Depends(current_email)):
     data = await request.json()
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
     if not current_data_state["isRunning"]:
         return {"status":"error","message":"Data collection not started"}   
     stop_eeg_pipeline()
@@ -161,11 +260,8 @@ async def stop_eeg_collection(request:Request):
     return {"status":"success","message":"Data collection stopped"}
 
 @router.post("/data-collected")
-async def data_collected(request:Request):
+async def data_collected(request:Request, email: str = Depends(current_email)):
     data = await request.json()
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
     if not data.get("state"):
         return {"status":"error","message":"Invalid request"}
     
@@ -174,16 +270,53 @@ async def data_collected(request:Request):
     if current_state not in ["Relaxing","Focused"]:
         return {"status":"error","message":"Invalid state"}
     
-    collection.update_one({"email":token_status["email"]},{"$set":{state_to_database[current_state]:True}})
+    await users_repository.set_fields(email,{state_to_database[current_state]:True})
     return {"status":"success","message":"Data collected successfully"}
 
 @router.post("/train-model")
-async def train_model(request:Request):
-    token_status = decode_token(request.cookies.get("access_token"))
-    if token_status["status"] == "error":
-        return {"status":"error","message":"Invalid token"}
-    stop_event.clear()
-    thread = threading.Thread(target=model_training_pipeline, args=(token_status["email"],))
-    thread.start()
-    return {"status":"success","message":"Model trained successfully"}
+async def train_model(email: str = Depends(current_email)):
+    # Training runs in a worker process; the user's cached model and auth
+    # state are dropped once the new model has been saved
+    if email in updating:
+        return {"status":"error","message":"Model update in progress"}
+    job, created = training_scheduler.submit(email, model_training_pipeline, email, on_done=training_finished)
+    if not job:
+        return {"status":"error","message":"Training queue is full, please try again later"}
+    if not created:
+        return {"status":"success","message":"Model training already in progress","job":job.to_dict()}
+    return {"status":"success","message":"Model training started","job":job.to_dict()}
+
+@router.post("/update-model")
+async def update_model(request:Request, email: str = Depends(current_email)):
+    # Defaults to the caller's most recent collection session; a
+    # batch-trained model is only replaced when "convert" is true
+    data = await request.json() if await request.body() else {}
+    job = training_scheduler.status(email)
+    if job and job["status"] in ("queued", "running"):
+        return {"status":"error","message":"Model training in progress","job":job}
+    # Both write the same model files
+    if email in updating:
+        return {"status":"error","message":"Model update in progress"}
+    updating.add(email)
+    try:
+        return await asyncio.to_thread(model_update_pipeline, email, data.get("session_id"),
+                                       bool(data.get("convert")))
+    finally:
+        updating.discard(email)
 
+@router.get("/export-data")
+async def export_data(request:Request, email: str = Depends(current_email)):
+    # Streams the user's feature windows as .npz (default) or .parquet;
+    # the cursor is read in a worker thread as the client downloads
+    export_format = request.query_params.get("format", "npz")
+    if export_format not in EXPORT_FORMATS:
+        return {"status":"error","message":"Invalid format"}
+    if export_format == "parquet" and not parquet_available():
+        return {"status":"error","message":"Parquet export is not available"}
+    # Windows still buffered by the writer belong in the export
+    if not await asyncio.to_thread(eeg_writer.flush, EEG_FLUSH_TIMEOUT):
+        print(f"EEG writer flush timed out; exporting {email} without the windows still queued")
+    export_class, media_type, extension = EXPORT_FORMATS[export_format]
+    export = export_class(eeg_collection, email)
+    headers = {"Content-Disposition": f'attachment; filename="eeg_data{extension}"'}
+    return StreamingResponse(export.stream(), media_type=media_type, headers=headers)
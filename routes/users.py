@@ -1,11 +1,12 @@
 from fastapi import APIRouter,HTTPException,Request,Response
 from models.users import User
 from response_models.users import AuthResponseModel,TokenResponseModel
-from utils.hash_helper import hash_password,create_access_token,verify_password,decode_token
+from utils.hash_helper import hash_password_async,create_access_token,verify_and_update_async,decode_token
 from utils.validators import validateSignupForm
 from utils.util_func import generate_otp
 from utils.send_email import send_email
-from database import db_instance
+from database import users_repository
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter()
 
@@ -17,13 +18,12 @@ async def signup(request:Request,response:Response):
     validation_error = validateSignupForm(user)
     if validation_error:
         return {"status":"error","message":validation_error}
-    collection = db_instance.get_collection("users")
-    if collection.find_one({"email":user["email"]}):
+    if await users_repository.exists(user["email"]):
         return  {"status":"error","message":"User already exists"}
         
     try:
-        user["password"] = hash_password(user["password"])
-        collection.insert_one(user)
+        user["password"] = await hash_password_async(user["password"])
+        await users_repository.create(user)
         access_token = create_access_token(data={"email":user["email"]})
         
         response.set_cookie(
@@ -38,18 +38,24 @@ async def signup(request:Request,response:Response):
 
         
         return {"status":"success","message":"User created successfully","access_token":access_token}
+    except DuplicateKeyError:
+        # Lost a race with a concurrent signup; the unique index on email decides
+        return  {"status":"error","message":"User already exists"}
     except Exception as e:
         return  {"status":"error","message":str(e)}
     
 @router.post("/login",response_model=AuthResponseModel)
 async def login(request:Request,response:Response):
     data = await request.json()
-    collection = db_instance.get_collection("users")
-    user = collection.find_one({"email":data["email"]})
+    user = await users_repository.find_by_email(data["email"],{"_id":0,"email":1,"password":1})
     if not user:
         return {"status":"error","message":"User not found","access_token":""}
-    if not verify_password(data["password"],user["password"]):
+    valid, new_hash = await verify_and_update_async(data["password"],user["password"])
+    if not valid:
         return {"status":"error","message":"Invalid credentials","access_token":""}
+    if new_hash:
+        # Stored with an older cost factor
+        await users_repository.set_fields(user["email"],{"password":new_hash})
     access_token = create_access_token(data={"email":user["email"]})
     response.set_cookie(
         key="access_token",
@@ -84,29 +90,25 @@ async def logout(response:Response):
 @router.post("/send-otp")
 async def send_otp(request:Request):
     data = await request.json()
-    collection = db_instance.get_collection("users")
-    user = collection.find_one({"email":data["email"]})
-    if not user:
+    if not await users_repository.exists(data["email"]):
         return {"status":"error","message":"User not found"}
     
     otp = generate_otp()
-    collection.update_one({"email":data["email"]},{"$set":{"otp":otp}})
+    await users_repository.set_fields(data["email"],{"otp":otp})
     
     template = f"""
     <h1>OTP for password reset</h1>
     <p>Your OTP is {otp}</p>
     """
-    try:
-        await send_email(data["email"],"Password Reset OTP",template)
-        return {"status":"success","message":"OTP sent successfully"}
-    except Exception as e:
+    # Sent by the background email dispatcher; the OTP is already stored
+    if not await send_email(data["email"],"Password Reset OTP",template):
         return {"status":"error","message":"Error sending OTP! Please try again later."}
+    return {"status":"success","message":"OTP sent successfully"}
     
 @router.post("/validate-otp")
 async def validate_otp(request:Request):
     data = await request.json()
-    collection = db_instance.get_collection("users")
-    user = collection.find_one({"email":data["email"]})
+    user = await users_repository.find_by_email(data["email"],{"_id":1,"otp":1})
     if not user:
         return {"status":"error","message":"User not found"}
     if not user.get("otp"):
@@ -118,14 +120,12 @@ async def validate_otp(request:Request):
 @router.post("/reset-password")
 async def reset_password(request:Request):
     data = await request.json()
-    collection = db_instance.get_collection("users")
-    user = collection.find_one({"email":data["email"]})
-    if not user:
+    if not await users_repository.exists(data["email"]):
         return {"status":"error","message":"User not found"}
     
     try:
-        collection.update_one({"email":data["email"]},{"$set":{"password":hash_password(data["password"])}})
-        collection.update_one({"email":data["email"]},{"$unset":{"otp":""}})
+        await users_repository.set_fields(data["email"],{"password":await hash_password_async(data["password"])})
+        await users_repository.unset_fields(data["email"],"otp")
         return {"status":"success","message":"Password reset successfully"}
     except Exception as e:
         return {"status":"error","message":"Error resetting password! Please try again later."}
@@ -0,0 +1,252 @@
+import io
+import os
+import time
+import numpy as np
+from numpy.lib import format as npy_format
+from .data_preprocessor import PreprocessEEG
+from .feature_selection import FeatureExtractor
+from utils.constants import state_to_label
+from utils.metrics import stage_seconds, samples_total, windows_total
+
+SCORING_BATCH_WINDOWS = int(os.environ.get("SCORING_BATCH_WINDOWS", 256))
+SCORING_MAX_WINDOW_SECONDS = float(os.environ.get("SCORING_MAX_WINDOW_SECONDS", 60))
+# Per channel: caps both the filtered samples held for a batch and the
+# windows * window samples its features are computed on
+SCORING_MAX_BATCH_SAMPLES = int(os.environ.get("SCORING_MAX_BATCH_SAMPLES", 1 << 18))
+
+label_names = {label: state for state, label in state_to_label.items()}
+
+
+class CsvStreamParser:
+    # Incremental parser for recordings written by eeg_collect (a header of
+    # eeg_data_<channel> columns, one sample per row); returns (channels, n)
+    # float blocks for whatever complete rows each chunk contains.
+    def __init__(self):
+        self.remainder = b""
+        self.columns = None
+        self.selected = None
+
+    def read_header(self, line):
+        names = [name.strip().strip('"') for name in line.decode(errors="ignore").split(",")]
+        try:
+            [float(name) for name in names]
+        except ValueError:
+            self.columns = names
+            eeg_columns = [i for i, name in enumerate(names) if name.startswith("eeg_data")]
+            self.selected = eeg_columns or list(range(len(names)))
+            return True
+        # No header row
+        self.columns = [f"eeg_data_{i}" for i in range(len(names))]
+        self.selected = list(range(len(names)))
+        return False
+
+    def feed(self, data):
+        data = self.remainder + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            self.remainder = data
+            return None
+        self.remainder = data[end + 1:]
+        return self.parse(data[:end + 1])
+
+    def finish(self):
+        if not self.remainder.strip():
+            return None
+        data, self.remainder = self.remainder + b"\n", b""
+        return self.parse(data)
+
+    def parse(self, lines):
+        lines = lines.replace(b"\r", b"")
+        if self.columns is None:
+            first, _, rest = lines.partition(b"\n")
+            if self.read_header(first):
+                lines = rest
+        lines = lines.strip(b"\n")
+        if not lines:
+            return None
+        n_columns = len(self.columns)
+        try:
+            values = np.fromstring(lines.replace(b"\n", b","), dtype=np.float64, sep=",")
+        except ValueError:
+            # fromstring raises on empty fields, e.g. from blank rows
+            values = None
+        if values is None or values.size % n_columns or values.size // n_columns != lines.count(b"\n") + 1:
+            # Blank or malformed rows; let loadtxt sort them out
+            values = np.loadtxt(io.BytesIO(lines), delimiter=",", ndmin=2)
+        rows = values.reshape(-1, n_columns)
+        return rows[:, self.selected].T
+
+
+class NpyStreamParser:
+    # Streams a .npy file holding (samples,) or (samples, channels) in C order
+    def __init__(self):
+        self.header = b""
+        self.dtype = None
+        self.channels = None
+        self.remainder = b""
+
+    def read_header(self):
+        stream = io.BytesIO(self.header)
+        try:
+            version = npy_format.read_magic(stream)
+            if version == (1, 0):
+                shape, fortran_order, dtype = npy_format.read_array_header_1_0(stream)
+            else:
+                shape, fortran_order, dtype = npy_format.read_array_header_2_0(stream)
+        except ValueError:
+            # Header not complete yet
+            if len(self.header) > 65536:
+                raise
+            return False
+        if fortran_order or len(shape) not in (1, 2) or dtype.hasobject:
+            raise ValueError("Expected a C-ordered (samples,) or (samples, channels) numeric array")
+        self.dtype = dtype
+        self.channels = shape[1] if len(shape) == 2 else 1
+        self.remainder = self.header[stream.tell():]
+        return True
+
+    def feed(self, data):
+        if self.dtype is None:
+            self.header += data
+            if not self.read_header():
+                return None
+            data = b""
+        data = self.remainder + data
+        row_size = self.dtype.itemsize * self.channels
+        usable = len(data) - len(data) % row_size
+        self.remainder = data[usable:]
+        if not usable:
+            return None
+        rows = np.frombuffer(data[:usable], dtype=self.dtype).reshape(-1, self.channels)
+        return rows.T.astype(np.float64)
+
+    def finish(self):
+        if self.dtype is None and self.header:
+            raise ValueError("Not a .npy file")
+        if self.remainder:
+            raise ValueError("Truncated .npy file")
+        return None
+
+
+def parser_for(content_type, filename=""):
+    if filename.endswith(".npy") or "npy" in content_type or "octet-stream" in content_type:
+        return NpyStreamParser()
+    return CsvStreamParser()
+
+
+class BatchScorer:
+    # Scores a continuous recording: samples are filtered once with the same
+    # causal filter as live prediction and data collection, cut into windows
+    # of `window` samples every `hop` samples, and each batch of windows goes
+    # through features and the model in single vectorized calls. Only the
+    # samples of the current batch are held in memory, at most
+    # SCORING_MAX_BATCH_SAMPLES per channel. Invalid windows raise
+    # ValueError.
+    def __init__(self, model, sampling_rate=512, window=512, hop=512, batch_windows=SCORING_BATCH_WINDOWS,
+                 max_batch_samples=SCORING_MAX_BATCH_SAMPLES):
+        if window > min(SCORING_MAX_WINDOW_SECONDS * sampling_rate, max_batch_samples):
+            raise ValueError(f"Windows are limited to {SCORING_MAX_WINDOW_SECONDS:g} seconds")
+        if hop < 1:
+            raise ValueError("Hop must be at least one sample")
+        self.model = model
+        self.sampling_rate = sampling_rate
+        self.window = window
+        self.hop = hop
+        self.batch_windows = max(1, min(batch_windows, max_batch_samples // window,
+                                        (max_batch_samples - window) // hop + 1))
+        self.preprocessor = PreprocessEEG(sampling_rate=sampling_rate)
+        self.feature_extractor = FeatureExtractor(sampling_rate=sampling_rate)
+        # Raises for windows too short for the feature bands
+        self.feature_extractor.spectrum_layout(window)
+        self.n_channels = model.n_channels
+        self.pending = None
+        self.offset = 0  # absolute index of pending[:, 0]
+        self.skip = 0  # samples between the last batch and the next window, when hop > window
+        self.windows_scored = 0
+        self.samples = 0
+        self.counts = {name: 0 for name in label_names.values()}
+        self.with_probabilities = True
+        self.preprocess_seconds = stage_seconds.labels(pipeline="scoring", stage="preprocess")
+        self.features_seconds = stage_seconds.labels(pipeline="scoring", stage="features")
+        self.predict_seconds = stage_seconds.labels(pipeline="scoring", stage="predict")
+
+    def feed(self, block):
+        if block is None or not block.shape[1]:
+            return []
+        if block.shape[0] < self.n_channels:
+            raise ValueError(f"Recording has {block.shape[0]} channels, the model needs {self.n_channels}")
+        self.samples += block.shape[1]
+        samples_total.labels(pipeline="scoring").inc(block.shape[1])
+        started = time.perf_counter()
+        filtered = self.preprocessor.preprocess_chunk(block[:self.n_channels])
+        self.preprocess_seconds.observe(time.perf_counter() - started)
+        if self.skip:
+            skipped = min(self.skip, filtered.shape[1])
+            filtered = filtered[:, skipped:]
+            self.skip -= skipped
+        self.pending = filtered if self.pending is None else np.concatenate([self.pending, filtered], axis=1)
+        results = []
+        batch_samples = self.window + (self.batch_windows - 1) * self.hop
+        while self.pending.shape[1] >= batch_samples:
+            results.extend(self.score(self.batch_windows))
+        return results
+
+    def finish(self):
+        if self.pending is None or self.pending.shape[1] < self.window:
+            return []
+        return self.score((self.pending.shape[1] - self.window) // self.hop + 1)
+
+    def score(self, n_windows):
+        windows = np.lib.stride_tricks.sliding_window_view(self.pending, self.window, axis=-1)
+        windows = windows[:, :n_windows * self.hop:self.hop].transpose(1, 0, 2)
+        started = time.perf_counter()
+        features = self.feature_extractor.calculate_features_batch(windows)
+        predict_started = time.perf_counter()
+        self.features_seconds.observe(predict_started - started)
+        X = self.model.scaler.transform(features)
+        labels = self.model.model.predict(X)
+        probabilities = self.predict_proba(X)
+        self.predict_seconds.observe(time.perf_counter() - predict_started)
+        windows_total.labels(pipeline="scoring").inc(n_windows)
+
+        results = []
+        for i, label in enumerate(labels):
+            start = self.offset + i * self.hop
+            name = label_names.get(int(label), str(label))
+            self.counts[name] = self.counts.get(name, 0) + 1
+            result = {
+                "window": self.windows_scored + i,
+                "start": start / self.sampling_rate,
+                "end": (start + self.window) / self.sampling_rate,
+                "prediction": int(label),
+                "label": name,
+            }
+            if probabilities is not None:
+                result["probabilities"] = {label_names.get(int(c), str(c)): float(p)
+                                           for c, p in zip(self.model.model.classes_, probabilities[i])}
+            results.append(result)
+
+        self.windows_scored += n_windows
+        consumed = n_windows * self.hop
+        self.skip = max(0, consumed - self.pending.shape[1])
+        self.pending = self.pending[:, consumed:].copy()
+        self.offset += consumed
+        return results
+
+    def predict_proba(self, X):
+        # Only models trained with probability estimates have them
+        if not self.with_probabilities:
+            return None
+        try:
+            return self.model.model.predict_proba(X)
+        except (AttributeError, ValueError):
+            self.with_probabilities = False
+            return None
+
+    def summary(self):
+        return {
+            "windows": self.windows_scored,
+            "samples": self.samples,
+            "seconds": self.samples / self.sampling_rate,
+            "counts": self.counts,
+        }
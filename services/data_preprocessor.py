@@ -1,5 +1,38 @@
 from scipy import signal
 import numpy as np
+import threading
+
+# Filter designs shared by every PreprocessEEG instance, keyed by
+# (sampling_rate, notch_freq, lowcut, highcut).
+_filter_cache = {}
+_filter_cache_lock = threading.Lock()
+
+
+def design_filters(sampling_rate, notch_freq, lowcut, highcut):
+    key = (sampling_rate, notch_freq, lowcut, highcut)
+    filters = _filter_cache.get(key)
+    if filters is not None:
+        return filters
+
+    with _filter_cache_lock:
+        if key not in _filter_cache:
+            nyquist = 0.5 * sampling_rate
+            notch_freq_normalized = notch_freq / nyquist
+            notch_b, notch_a = signal.iirnotch(notch_freq_normalized, Q=0.05, fs = sampling_rate)
+
+            lowcut_normalized = lowcut / nyquist
+            highcut_normalized = highcut / nyquist
+            band_pass_b, band_pass_a = signal.butter(4, [lowcut_normalized, highcut_normalized], btype='band')
+
+            sos = np.vstack([signal.tf2sos(notch_b, notch_a), signal.tf2sos(band_pass_b, band_pass_a)])
+            _filter_cache[key] = {
+                "notch": (notch_b, notch_a),
+                "band_pass": (band_pass_b, band_pass_a),
+                "sos": sos,
+                "sos_zi": signal.sosfilt_zi(sos),
+            }
+        return _filter_cache[key]
+
 
 class PreprocessEEG:
     def __init__(self,sampling_rate = 512,notch_freq = 50, lowcut = 0.5, highcut = 30):
@@ -7,40 +40,97 @@ class PreprocessEEG:
         self.notch_freq = notch_freq
         self.lowcut = lowcut
         self.highcut = highcut
+        self.zi = None
+        self.interpolated_samples = 0
+        self.buffers = {}
     
-    def clean_data(self,data):
-        data = np.array(data, dtype=np.float64)
-        data[data == 0] = np.nan
-        data[data > 4096] = np.nan
-        indices = np.arange(len(data))
-        valid_indices = indices[~np.isnan(data)] 
-        invalid_indices = indices[np.isnan(data)]  
-        if len(invalid_indices) > 0:
-            data[invalid_indices] = np.interp(invalid_indices, valid_indices, data[valid_indices])
-        return data.tolist()
+    def reusable(self, name, shape, dtype=np.float64):
+        # View of a buffer kept by this preprocessor that grows to the
+        # largest chunk seen so far
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape[:-1] != shape[:-1] or buffer.shape[-1] < shape[-1]:
+            capacity = shape[:-1] + (max(shape[-1], 2 * self.sampling_rate),)
+            buffer = self.buffers[name] = np.empty(capacity, dtype=dtype)
+        return buffer[..., :shape[-1]]
+
+    def clean_data(self,data,out=None):
+        # Works along the last axis, so data may be (samples,) or
+        # (channels, samples). Dropouts (0 or > 4096) are replaced by linear
+        # interpolation between the nearest valid samples of the same channel.
+        # Returns a new float64 array, or cleans into the float64 array out
+        # without allocating when there are no dropouts.
+        if out is None:
+            data = np.array(data, dtype=np.float64)
+            invalid = (data == 0) | (data > 4096)
+        else:
+            np.copyto(out, data)
+            data = out
+            invalid = np.equal(data, 0, out=self.reusable("invalid", data.shape, bool))
+            invalid |= np.greater(data, 4096, out=self.reusable("high", data.shape, bool))
+        if not invalid.any():
+            return data
+        self.interpolated_samples += int(np.count_nonzero(invalid))
+        n = data.shape[-1]
+        indices = np.broadcast_to(np.arange(n), data.shape)
+        prev_index = np.maximum.accumulate(np.where(invalid, -1, indices), axis=-1)
+        next_index = np.flip(np.minimum.accumulate(np.flip(np.where(invalid, n, indices), axis=-1), axis=-1), axis=-1)
+
+        has_prev = prev_index >= 0
+        has_next = next_index < n
+        prev_index = np.where(has_prev, prev_index, next_index).clip(0, n - 1)
+        next_index = np.where(has_next, next_index, prev_index).clip(0, n - 1)
+        prev_value = np.take_along_axis(data, prev_index, axis=-1)
+        next_value = np.take_along_axis(data, next_index, axis=-1)
+        span = next_index - prev_index
+        weight = np.divide(indices - prev_index, span, out=np.zeros(data.shape), where=span > 0)
+        interpolated = prev_value + weight * (next_value - prev_value)
+
+        # Channels without a single valid sample are flattened to zero
+        interpolated[~(has_prev | has_next)] = 0
+        data[invalid] = interpolated[invalid]
+        return data
 
     
     def initialize_filter(self):
-        nyquist = 0.5 * self.sampling_rate
-        notch_freq_normalized = self.notch_freq / nyquist
-        self.notch_b, self.notch_a = signal.iirnotch(notch_freq_normalized, Q=0.05, fs = self.sampling_rate)
-        
-        lowcut_normalized = self.lowcut / nyquist
-        highcut_normalized = self.highcut / nyquist
-        self.band_pass_b, self.band_pass_a = signal.butter(4, [lowcut_normalized, highcut_normalized], btype='band')
+        filters = design_filters(self.sampling_rate, self.notch_freq, self.lowcut, self.highcut)
+        self.notch_b, self.notch_a = filters["notch"]
+        self.band_pass_b, self.band_pass_a = filters["band_pass"]
+        self.sos = filters["sos"]
+        self.sos_zi = filters["sos_zi"]
     
     def apply_filter(self, data):
-        notch_filtered = signal.filtfilt(self.notch_b, self.notch_a, data)
-        band_pass_filtered = signal.filtfilt(self.band_pass_b, self.band_pass_a, notch_filtered)        
+        notch_filtered = signal.filtfilt(self.notch_b, self.notch_a, data, axis=-1)
+        band_pass_filtered = signal.filtfilt(self.band_pass_b, self.band_pass_a, notch_filtered, axis=-1)        
         return band_pass_filtered
     
     
     def preprocess(self, data):
+        # Zero-phase batch mode for complete, independent windows (offline
+        # training data, uploaded recordings).
         self.initialize_filter()
         data = self.clean_data(data)
         filtered_data = self.apply_filter(data)
         return filtered_data   
 
+    def reset(self):
+        self.zi = None
+
+    def preprocess_chunk(self, data):
+        # Causal streaming mode: consecutive chunks of one continuous signal
+        # are filtered exactly once, carrying the sosfilt state across calls.
+        if self.zi is None:
+            self.initialize_filter()
+        data = np.asarray(data)
+        # sosfilt copies its input into the array it returns, so cleaning
+        # into the reused buffer leaves that copy as the only allocation
+        data = self.clean_data(data, out=self.reusable("chunk", data.shape))
+        if self.zi is None or self.zi.shape[1:-1] != data.shape[:-1]:
+            # Start in steady state for the first sample to avoid a transient
+            first = data[..., 0]
+            self.zi = self.sos_zi.reshape((self.sos_zi.shape[0],) + (1,) * first.ndim + (2,)) * first[..., np.newaxis]
+        filtered_data, self.zi = signal.sosfilt(self.sos, data, axis=-1, zi=self.zi)
+        return filtered_data
+
 if __name__ == '__main__':
     data = [1,2,4090,4098,500,3,4,5,6,7,8,9,10,0,0,0,4095]
     preprocessor = PreprocessEEG()
@@ -0,0 +1,303 @@
+import os
+import sys
+import importlib.util
+import zipfile
+import tempfile
+import numpy as np
+from numpy.lib import format as npy_format
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 5000))  # documents per cursor batch and per chunk
+
+EXPORT_PROJECTION = {"_id": 0, "email": 1, "features": 1, "label": 1, "session_id": 1}
+
+# An export holds one row per feature window:
+#   features  (n, n_features) float32
+#   label     (n,) int8, -1 for rows of documents deleted during the export
+#   user      (n,) int32 index into emails
+#   session   (n,) int32 index into sessions, -1 when the window had none
+#   emails    (users,) str
+#   sessions  (sessions,) str
+
+
+def export_query(emails=None):
+    if emails is None:
+        return {}
+    if isinstance(emails, str):
+        return {"email": emails}
+    return {"email": {"$in": list(emails)}}
+
+
+class Codes:
+    # Maps repeated strings (emails, session ids) to small integer codes
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def array(self):
+        return np.array(self.values, dtype=str)
+
+
+def iter_chunks(collection, query, n_features, limit=0, batch_size=EXPORT_BATCH_SIZE, emails=None, sessions=None):
+    # Yields (features, label, user, session) arrays of up to batch_size
+    # rows, filled in place from the cursor; the buffers are reused, so
+    # consumers must write each chunk out before asking for the next.
+    emails = emails if emails is not None else Codes()
+    sessions = sessions if sessions is not None else Codes()
+    features = np.empty((batch_size, n_features), dtype=np.float32)
+    label = np.empty(batch_size, dtype=np.int8)
+    user = np.empty(batch_size, dtype=np.int32)
+    session = np.empty(batch_size, dtype=np.int32)
+
+    cursor = collection.find(query, EXPORT_PROJECTION, batch_size=batch_size, limit=limit)
+    filled = 0
+    try:
+        for document in cursor:
+            row = document["features"]
+            if len(row) != n_features:
+                raise ValueError(f"Expected {n_features} features, got {len(row)}")
+            features[filled] = row
+            label[filled] = document["label"]
+            user[filled] = emails.code(document.get("email"))
+            session[filled] = sessions.code(document.get("session_id"))
+            filled += 1
+            if filled == batch_size:
+                yield features, label, user, session
+                filled = 0
+    finally:
+        cursor.close()
+    if filled:
+        yield features[:filled], label[:filled], user[:filled], session[:filled]
+
+
+def feature_count(collection, query):
+    document = collection.find_one(query, {"_id": 0, "features": 1})
+    return len(document["features"]) if document else 0
+
+
+TRAINING_PROJECTION = {"_id": 0, "features": 1, "label": 1}
+
+
+def load_training_set(collection, query, batch_size=EXPORT_BATCH_SIZE):
+    # Fills preallocated float32 features and int8 labels straight from the
+    # cursor, sized by count_documents. Windows written after the count are
+    # left for the next load; rows of deleted documents are cut off.
+    count = collection.count_documents(query)
+    if not count:
+        return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int8)
+    n_features = feature_count(collection, query)
+    X = np.empty((count, n_features), dtype=np.float32)
+    y = np.empty(count, dtype=np.int8)
+    filled = 0
+    cursor = collection.find(query, TRAINING_PROJECTION, batch_size=batch_size, limit=count)
+    try:
+        for document in cursor:
+            X[filled] = document["features"]
+            y[filled] = document["label"]
+            filled += 1
+    finally:
+        cursor.close()
+    return X[:filled], y[:filled]
+
+
+class StreamBuffer:
+    # Write-only file object for ZipFile on unseekable outputs; the bytes
+    # written since the last drain() are handed to the caller in order.
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def write_npy_header(member, dtype, shape):
+    header = {"descr": npy_format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape}
+    npy_format.write_array_header_2_0(member, header)
+
+
+class NpzExport:
+    # Streams an export into an .npz readable with np.load. The features
+    # member is written while the cursor is read, with its npy header sized
+    # up front from count_documents; the small per-row columns are spooled
+    # to temporary files and appended afterwards, since zip members cannot
+    # be interleaved.
+    def __init__(self, collection, emails=None, batch_size=EXPORT_BATCH_SIZE, compress=False):
+        self.collection = collection
+        self.query = export_query(emails)
+        self.batch_size = batch_size
+        self.compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.rows = 0
+
+    def write(self, out):
+        # out is a path or a binary file object; returns the number of rows
+        for _ in self.stream(out):
+            pass
+        return self.rows
+
+    def stream(self, out=None):
+        # Yields the archive in pieces as it is produced when out is None,
+        # otherwise writes to out and yields nothing
+        buffer = StreamBuffer() if out is None else None
+        target = buffer if out is None else out
+        count = self.collection.count_documents(self.query)
+        n_features = feature_count(self.collection, self.query) if count else 0
+        emails, sessions = Codes(), Codes()
+        columns = {name: tempfile.TemporaryFile() for name in ("label", "user", "session")}
+        try:
+            with zipfile.ZipFile(target, mode="w", compression=self.compression, allowZip64=True) as archive:
+                with archive.open("features.npy", mode="w", force_zip64=True) as member:
+                    write_npy_header(member, np.float32, (count, n_features))
+                    for features, label, user, session in iter_chunks(
+                            self.collection, self.query, n_features, limit=count, batch_size=self.batch_size,
+                            emails=emails, sessions=sessions):
+                        member.write(features.tobytes())
+                        columns["label"].write(label.tobytes())
+                        columns["user"].write(user.tobytes())
+                        columns["session"].write(session.tobytes())
+                        self.rows += len(label)
+                        if buffer is not None:
+                            yield buffer.drain()
+                    # Documents deleted after count_documents leave padding
+                    # rows, marked with label -1
+                    missing = count - self.rows
+                    if missing:
+                        print(f"{missing} documents disappeared during the export; padding with label -1")
+                        member.write(np.full((missing, n_features), np.nan, dtype=np.float32).tobytes())
+                        columns["label"].write(np.full(missing, -1, dtype=np.int8).tobytes())
+                        columns["user"].write(np.full(missing, -1, dtype=np.int32).tobytes())
+                        columns["session"].write(np.full(missing, -1, dtype=np.int32).tobytes())
+
+                for name, dtype in (("label", np.int8), ("user", np.int32), ("session", np.int32)):
+                    spool = columns[name]
+                    spool.seek(0)
+                    with archive.open(f"{name}.npy", mode="w", force_zip64=True) as member:
+                        write_npy_header(member, dtype, (count,))
+                        while True:
+                            data = spool.read(1 << 20)
+                            if not data:
+                                break
+                            member.write(data)
+                    if buffer is not None:
+                        yield buffer.drain()
+
+                for name, codes in (("emails", emails), ("sessions", sessions)):
+                    with archive.open(f"{name}.npy", mode="w") as member:
+                        npy_format.write_array(member, codes.array())
+        finally:
+            for spool in columns.values():
+                spool.close()
+        if buffer is not None:
+            yield buffer.drain()
+
+
+class ParquetExport:
+    # One row group per cursor batch; needs pyarrow, which is optional
+    def __init__(self, collection, emails=None, batch_size=EXPORT_BATCH_SIZE, compression="zstd"):
+        self.collection = collection
+        self.query = export_query(emails)
+        self.batch_size = batch_size
+        self.compression = compression
+        self.rows = 0
+
+    def write(self, out):
+        for _ in self.stream(out):
+            pass
+        return self.rows
+
+    def stream(self, out=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+        buffer = StreamBuffer() if out is None else None
+        n_features = feature_count(self.collection, self.query)
+        schema = pa.schema([
+            ("email", pa.string()),
+            ("session_id", pa.string()),
+            ("label", pa.int8()),
+            ("features", pa.list_(pa.float32(), n_features)),
+        ])
+        emails, sessions = Codes(), Codes()
+        with pq.ParquetWriter(buffer if out is None else out, schema, compression=self.compression) as writer:
+            for features, label, user, session in iter_chunks(self.collection, self.query, n_features,
+                                                              batch_size=self.batch_size,
+                                                              emails=emails, sessions=sessions):
+                # Strings are only materialized per chunk; Parquet
+                # dictionary-encodes the repeated values
+                email_values = np.array(emails.values + [None], dtype=object)
+                session_values = np.array(sessions.values + [None], dtype=object)
+                table = pa.table({
+                    "email": pa.array(email_values[user], pa.string()),
+                    "session_id": pa.array(session_values[session], pa.string()),
+                    "label": pa.array(label),
+                    "features": pa.FixedSizeListArray.from_arrays(pa.array(features.ravel()), n_features),
+                }, schema=schema)
+                writer.write_table(table)
+                self.rows += len(label)
+                if buffer is not None:
+                    yield buffer.drain()
+        if buffer is not None:
+            yield buffer.drain()
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+EXPORT_FORMATS = {
+    "npz": (NpzExport, "application/zip", ".npz"),
+    "parquet": (ParquetExport, "application/vnd.apache.parquet", ".parquet"),
+}
+
+
+if __name__ == "__main__":
+    # python -m services.dataset_export --email user@example.com --output user.npz
+    # python -m services.dataset_export --all --format parquet --output cohort.parquet
+    import argparse
+    from database import db_instance
+
+    parser = argparse.ArgumentParser(description="Export EEG feature windows from MongoDB")
+    parser.add_argument("--email", action="append", help="user to export (repeatable)")
+    parser.add_argument("--all", action="store_true", help="export every user")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="npz")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--compress", action="store_true", help="deflate the .npz members")
+    args = parser.parse_args()
+    if not args.email and not args.all:
+        parser.error("pass --email or --all")
+
+    export_class = EXPORT_FORMATS[args.format][0]
+    options = {"compress": args.compress} if args.format == "npz" else {}
+    export = export_class(db_instance.get_collection("eeg_data"), None if args.all else args.email,
+                          batch_size=args.batch_size, **options)
+    rows = export.write(args.output)
+    print(f"Exported {rows} windows to {args.output}", file=sys.stderr)
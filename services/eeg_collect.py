@@ -1,23 +1,27 @@
 import serial
-import time
 import numpy as np
-import pandas as pd
+from .serial_decoder import TextDecoder, BinaryDecoder
+
 class SensorReader:
-    def __init__(self, port, baud_rate=115200, timeout=1):
+    def __init__(self, port, baud_rate=115200, timeout=1, channels=3, binary=False):
         self.port = port
         self.baud_rate = baud_rate
         self.timeout = timeout
         self.ser = None
         self.FREQ = 512 
+        self.channels = channels
+        self.binary = binary
+        self.decoder = BinaryDecoder(channels) if binary else TextDecoder(channels)
             
     def connect(self):
         try:
-            self.ser = serial.Serial()
-            self.ser.port = self.port
+            # Besides device names (COM3, /dev/ttyUSB0, a virtual device's
+            # pty) this accepts pyserial URLs such as socket://host:port
+            self.ser = serial.serial_for_url(self.port, do_not_open=True)
             self.ser.baudrate = self.baud_rate
             self.ser.timeout = self.timeout
-            self.ser.setDTR(False)
-            self.ser.setRTS(False)
+            self.ser.dtr = False
+            self.ser.rts = False
             
             self.ser.open()
             print(f"Connected to {self.port} at {self.baud_rate} baud.")
@@ -43,35 +47,57 @@ class SensorReader:
             return False
 
     def start_reading(self):
+        self.send_command("binary_mode" if self.binary else "text_mode")
         return self.send_command("start_reading")
 
     def stop_reading(self):
         return self.send_command("stop_reading")
 
-    def read_data(self):
-        if self.ser and self.ser.is_open:
-            if self.ser.in_waiting > 0:
-                data = self.ser.readline().decode('utf-8').strip()
-                return data
-        return None
+    @property
+    def is_open(self):
+        return bool(self.ser and self.ser.is_open)
+
+    @property
+    def dropped_samples(self):
+        return self.decoder.dropped_samples
+
+    def read_block(self):
+        # Drain everything waiting on the port in one call and decode it into
+        # a (channels, n) int16 block. Blocks for up to `timeout` seconds on a
+        # single byte when the port is idle instead of polling with sleeps.
+        if not self.is_open:
+            return self.decoder.block[:, :0]
+        data = self.ser.read(max(1, self.ser.in_waiting))
+        waiting = self.ser.in_waiting
+        if waiting:
+            data += self.ser.read(waiting)
+        return self.decoder.decode(data)
 
     def read_sensor_data(self):
-        while True:
-            data = self.read_data()
-            if data:
-                sensor_values = int(data)
-                yield sensor_values 
-            time.sleep(1 / self.FREQ)
-    
+        # Ends when the port is closed (or never opened) instead of spinning
+        # on empty reads
+        while self.is_open:
+            block = self.read_block()
+            if block.shape[1]:
+                yield block
+
     def read_one_second_data(self):
-        data = []
-        for sample in self.read_sensor_data():
-            data.append(sample)
-            if len(data) == self.FREQ:
-                yield data
-                data = []
+        data = np.empty((self.channels, self.FREQ), dtype=np.int16)
+        count = 0
+        for block in self.read_sensor_data():
+            position = 0
+            while position < block.shape[1]:
+                n = min(self.FREQ - count, block.shape[1] - position)
+                data[:, count:count + n] = block[:, position:position + n]
+                count += n
+                position += n
+                if count == self.FREQ:
+                    yield data.copy()
+                    count = 0
 
 if __name__ == "__main__":
+    import pandas as pd
+
     sensor = SensorReader(port='COM3')  # Replace with your serial port
     eeg_data = []
     if sensor.connect():
@@ -87,9 +113,8 @@ if __name__ == "__main__":
             sensor.stop_reading()
             sensor.disconnect()
     
-    eeg_data = np.array(eeg_data)
-    eeg_data = eeg_data.flatten()  
+    eeg_data = np.hstack(eeg_data).T if eeg_data else np.empty((0, sensor.channels))
     
-    df = pd.DataFrame(eeg_data,columns=['eeg_data'])
+    df = pd.DataFrame(eeg_data,columns=[f'eeg_data_{i}' for i in range(sensor.channels)])
     df.to_csv("eeg_data.csv", index=False)
     print("EEG data saved to eeg_data.csv")
\ No newline at end of file
@@ -0,0 +1,207 @@
+import os
+import time
+import threading
+from queue import Queue, Empty
+from bson import ObjectId, json_util
+from pymongo.errors import PyMongoError, BulkWriteError
+from utils.metrics import registry
+
+insert_seconds = registry.histogram("bci_mongo_insert_seconds", "Duration of insert_many calls for EEG documents")
+documents_total = registry.counter("bci_mongo_documents_total", "EEG documents by outcome", ("result",))
+
+EEG_WRITE_BATCH = int(os.environ.get("EEG_WRITE_BATCH", 64))
+EEG_WRITE_INTERVAL = float(os.environ.get("EEG_WRITE_INTERVAL", 2.0))  # seconds
+EEG_SPOOL_PATH = os.environ.get("EEG_SPOOL_PATH", os.path.join("spool", "eeg_data.jsonl"))
+EEG_SPOOL_RETRY = float(os.environ.get("EEG_SPOOL_RETRY", 30.0))  # seconds
+EEG_FLUSH_TIMEOUT = float(os.environ.get("EEG_FLUSH_TIMEOUT", 30.0))  # seconds
+
+DUPLICATE_KEY = 11000
+
+
+class BatchedWriter:
+    # Buffers documents from acquisition threads and writes them with
+    # insert_many from a background thread. Batches that cannot be written
+    # are appended to a local spool file and replayed once MongoDB accepts
+    # writes again. Every document gets its _id up front, so replaying a
+    # batch that was partly written is harmless.
+    def __init__(self, collection, batch_size=EEG_WRITE_BATCH, flush_interval=EEG_WRITE_INTERVAL,
+                 spool_path=EEG_SPOOL_PATH, retry_interval=EEG_SPOOL_RETRY):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.retry_interval = retry_interval
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.last_replay = 0.0
+
+        self.written = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.quarantined = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="eeg-writer", daemon=True)
+                self.thread.start()
+
+    def put(self, document):
+        document.setdefault("_id", ObjectId())
+        self.start()
+        self.queue.put(document)
+
+    def flush(self, timeout=EEG_FLUSH_TIMEOUT):
+        # Blocks until everything queued so far is written or spooled;
+        # returns False if that takes longer than timeout
+        if self.thread is None:
+            return True
+        if not self.thread.is_alive():
+            # Restart a writer thread that died, or nothing would ever
+            # answer the flush
+            self.start()
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = self.retry_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = False
+
+            if isinstance(item, dict):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            # Size or time threshold reached, flush requested, or closing
+            try:
+                if batch:
+                    self.write(batch)
+                    batch = []
+                self.replay_spool()
+            except Exception as e:
+                # Whatever went wrong, later batches still need a writer;
+                # batch is only non-empty if writing it failed
+                print(f"EEG writer error, {len(batch)} documents dropped: {e}")
+                self.dropped += len(batch)
+                documents_total.inc(len(batch), result="dropped")
+            finally:
+                batch = []
+                deadline = None
+                if isinstance(item, threading.Event):
+                    item.set()
+            if item is None:
+                return
+
+    def write(self, batch):
+        try:
+            self.insert(batch)
+            self.written += len(batch)
+            documents_total.inc(len(batch), result="written")
+        except PyMongoError as e:
+            print(f"Spooling {len(batch)} EEG documents: {e}")
+            self.failed_flushes += 1
+            self.spool(batch)
+
+    def insert(self, batch):
+        started = time.perf_counter()
+        try:
+            self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+            if errors or e.details.get("writeConcernErrors"):
+                raise
+        finally:
+            insert_seconds.observe(time.perf_counter() - started)
+
+    def spool(self, batch):
+        try:
+            directory = os.path.dirname(self.spool_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.spool_path, "a") as f:
+                for document in batch:
+                    f.write(json_util.dumps(document) + "\n")
+        except OSError as e:
+            # Disk full or spool directory not writable; nowhere left to
+            # keep the batch
+            print(f"Dropping {len(batch)} EEG documents, spool not writable: {e}")
+            self.dropped += len(batch)
+            documents_total.inc(len(batch), result="dropped")
+            return
+        self.spooled += len(batch)
+        documents_total.inc(len(batch), result="spooled")
+
+    def replay_spool(self):
+        replaying_path = self.spool_path + ".replaying"
+        if not os.path.exists(self.spool_path) and not os.path.exists(replaying_path):
+            return
+        if time.monotonic() - self.last_replay < self.retry_interval:
+            return
+        self.last_replay = time.monotonic()
+
+        # Move the spool aside so new failures append to a fresh file; a
+        # leftover .replaying file from an earlier attempt is retried first.
+        try:
+            if not os.path.exists(replaying_path):
+                os.replace(self.spool_path, replaying_path)
+            with open(replaying_path) as f:
+                batch = []
+                for line in f:
+                    try:
+                        batch.append(json_util.loads(line))
+                    except ValueError:
+                        # Torn line, e.g. from a spool write that hit a
+                        # full disk
+                        self.quarantine(line)
+                        continue
+                    if len(batch) == self.batch_size:
+                        self.insert(batch)
+                        self.replayed += len(batch)
+                        documents_total.inc(len(batch), result="replayed")
+                        batch = []
+                if batch:
+                    self.insert(batch)
+                    self.replayed += len(batch)
+                    documents_total.inc(len(batch), result="replayed")
+            os.remove(replaying_path)
+        except (PyMongoError, OSError) as e:
+            print(f"EEG spool replay failed, retrying later: {e}")
+            return
+        print(f"Replayed spooled EEG documents from {self.spool_path}")
+
+    def quarantine(self, line):
+        # Kept next to the spool for inspection instead of failing every
+        # replay on it
+        print(f"Moving an unreadable line of {self.spool_path} to {self.spool_path}.bad")
+        self.quarantined += 1
+        with open(self.spool_path + ".bad", "a") as f:
+            f.write(line if line.endswith("\n") else line + "\n")
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "quarantined": self.quarantined,
+            "failed_flushes": self.failed_flushes,
+        }
@@ -1,82 +1,238 @@
 import numpy as np
-import pandas as pd
 from scipy import signal
 
 
+BANDS = {
+    "alpha": (8, 12),
+    "beta": (14, 30),
+    "theta": (4, 7),
+    "delta": (0.5, 3),
+}
+
+# numpy.fft functions take out= from NumPy 2.0
+RFFT_OUT = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+
+class FeatureWorkspace:
+    # Scratch arrays for one data shape (..., samples). All of them are
+    # C-contiguous with the data's full shape, so every elementwise call
+    # runs on same-shape contiguous operands and NumPy never has to buffer
+    # (copy) one of them; broadcast operands (means, the Hann window, the
+    # PSD scale) are spread out with copyto first. Differences along the
+    # last axis are taken over the flattened arrays, which leaves junk in
+    # the last column(s) of each row that the reductions skip. A workspace
+    # kept between calls lets windows of the same shape be turned into
+    # features without allocating.
+    def __init__(self, shape, layout):
+        lead, n = shape[:-1], shape[-1]
+        spectrum_shape = lead + (n // 2 + 1,)
+        self.shape = shape
+        self.mean = np.empty(lead + (1,))
+        self.fill = np.empty(shape)
+        self.window = np.empty(shape)
+        np.copyto(self.window, layout["window"])
+        self.centred = np.empty(shape)
+        self.spectrum = np.empty(spectrum_shape, dtype=np.complex128)
+        self.psd = np.empty(spectrum_shape)
+        self.psd_scale = np.empty(spectrum_shape)
+        np.copyto(self.psd_scale, layout["psd_scale"])
+        self.log_psd = np.empty(spectrum_shape)
+        self.peak = np.empty(lead, dtype=np.intp)
+        # Zeroed so the never-written last element stays finite
+        self.first_diff = np.zeros(shape)
+        self.second_diff = np.zeros(shape)
+        self.crossings = np.zeros(shape)
+        self.scratch = np.empty(shape)
+        self.std = np.empty(lead)
+        self.first_diff_std = np.empty(lead)
+        self.second_diff_std = np.empty(lead)
+        self.total_power = np.empty(lead)
+
+
 class FeatureExtractor:
+    # All calculations work along the last axis, so data may be a single
+    # window (samples,), a multi-channel window (channels, samples) or a
+    # batch of windows (N, [channels,] samples).
     def __init__(self,sampling_rate = 512):
         self.COLUMNS = ["energy_alpha", "energy_beta", "energy_theta", "energy_delta", "alpha_beta_ratio",
                         "max_freq", "spectral_centroid", "spectral_slope",
                         "mean", "variance", "rms", "zero_crossings", "hjorth_mobility", "hjorth_complexity"]
         self.sampling_rate = sampling_rate
-    
-    def calculate_psd_features(self,data):
-        freqs, psd = signal.welch(data, fs = self.sampling_rate, nperseg = len(data))
-        
-        energy_alpha = np.sum(psd[(freqs >= 8) & (freqs <= 12)])
-        energy_beta = np.sum(psd[(freqs >= 14) & (freqs <= 30)])
-        energy_theta = np.sum(psd[(freqs >= 4) & (freqs <= 7)])
-        energy_delta = np.sum(psd[(freqs >= 0.5) & (freqs <= 3)])
-        
-        alpha_beta_ratio = energy_alpha / energy_beta if energy_beta != 0 else 0
-        
-        features = {
-            'energy_alpha': float(energy_alpha),
-            'energy_beta': float(energy_beta),
-            'energy_theta': float(energy_theta),
-            'energy_delta': float(energy_delta),
-            'alpha_beta_ratio': float(alpha_beta_ratio)
-        }
-        
-        return features
-    
-    def calculate_spectral_features(self,data):
-        freqs, psd = signal.welch(data, fs = self.sampling_rate, nperseg = len(data))
-        max_freq = freqs[np.argmax(psd)]
-        spectral_centroid = np.sum(freqs * psd) / np.sum(psd)
-        log_freqs = np.log(freqs[1:])
-        log_psd = np.log(psd[1:])
-        spectral_slope = np.polyfit(log_freqs, log_psd, 1)[0]
-        
-        features ={
-            'max_freq': float(max_freq),
-            'spectral_centroid': float(spectral_centroid),
-            'spectral_slope': float(spectral_slope)
-        }
-        
-        return features
-        
-
-
-    def calculate_temporal_features(self,data):
-        mean_value =  np.mean(data)
-        variance = np.var(data)
-        
-        rms = np.sqrt(np.mean(np.square(data)))
-        zero_crossings = np.sum(np.diff(np.sign(data)) != 0)
-        mobility = np.std(np.diff(data)) / np.std(data)
-        complexity = (np.std(np.diff(np.diff(data))) / np.std(np.diff(data))) / mobility
-        features = {
-            "mean": float(mean_value),
-            "variance": float(variance),
-            "rms": float(rms),
-            "zero_crossings": float(zero_crossings),
-            "hjorth_mobility": float(mobility),
-            "hjorth_complexity": float(complexity),
-        }
-        
-        return features
-
-    
+        self.layouts = {}
+        self.workspaces = {}
+
+    def feature_columns(self, channels=None):
+        if channels is None:
+            return self.COLUMNS
+        return [f"ch{channel}_{column}" for channel in range(channels) for column in self.COLUMNS]
+
+    def spectrum_layout(self, n_samples):
+        # Frequency bins, band index slices and the centred log-frequency axis
+        # of the spectral slope fit only depend on the window length.
+        layout = self.layouts.get(n_samples)
+        if layout is None:
+            freqs = np.fft.rfftfreq(n_samples, d=1 / self.sampling_rate)
+            bands = {}
+            for band, (low, high) in BANDS.items():
+                indices = np.flatnonzero((freqs >= low) & (freqs <= high))
+                if not len(indices):
+                    # Too short a window (or too low a sampling rate) to
+                    # resolve the band
+                    raise ValueError(f"{n_samples} samples at {self.sampling_rate} Hz have no frequency bin "
+                                     f"in the {band} band ({low}-{high} Hz)")
+                bands[band] = slice(indices[0], indices[-1] + 1)
+            # welch with nperseg == n is a single Hann-windowed periodogram
+            # of the mean-removed window, one-sided density scaling
+            window = signal.get_window("hann", n_samples)
+            psd_scale = np.full(len(freqs), 1 / (self.sampling_rate * np.sum(window * window)))
+            psd_scale[1:len(freqs) - (n_samples % 2 == 0)] *= 2
+            log_freqs = np.log(freqs[1:])
+            centred_log_freqs = log_freqs - log_freqs.mean()
+            # Same weights over the full spectrum, with the DC bin left out
+            slope_weights = np.concatenate([[0.0], centred_log_freqs])
+            layout = {
+                "freqs": freqs,
+                "window": window,
+                "psd_scale": psd_scale,
+                "bands": bands,
+                "slope_weights": slope_weights,
+                "slope_denominator": np.dot(centred_log_freqs, centred_log_freqs),
+            }
+            self.layouts[n_samples] = layout
+        return layout
+
+    def workspace(self, shape):
+        # Kept per shape; live prediction only ever uses one window shape
+        workspace = self.workspaces.get(shape)
+        if workspace is None:
+            if len(self.workspaces) >= 4:
+                self.workspaces.clear()
+            workspace = self.workspaces[shape] = FeatureWorkspace(shape, self.spectrum_layout(shape[-1]))
+        return workspace
+
+    def calculate_psd(self, data, workspace=None):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        layout = self.spectrum_layout(data.shape[-1])
+        workspace = workspace or FeatureWorkspace(data.shape, layout)
+        np.mean(data, axis=-1, keepdims=True, out=workspace.mean)
+        np.copyto(workspace.fill, workspace.mean)
+        np.subtract(data, workspace.fill, out=workspace.centred)
+        np.multiply(workspace.centred, workspace.window, out=workspace.centred)
+        if RFFT_OUT:
+            np.fft.rfft(workspace.centred, axis=-1, out=workspace.spectrum)
+        else:
+            workspace.spectrum[...] = np.fft.rfft(workspace.centred, axis=-1)
+        psd = np.abs(workspace.spectrum, out=workspace.psd)
+        np.square(psd, out=psd)
+        np.multiply(psd, workspace.psd_scale, out=psd)
+        return psd
+
+    def calculate_psd_features(self, psd, layout, out):
+        bands = layout["bands"]
+        energy_alpha = np.sum(psd[..., bands["alpha"]], axis=-1, out=out[..., 0])
+        energy_beta = np.sum(psd[..., bands["beta"]], axis=-1, out=out[..., 1])
+        np.sum(psd[..., bands["theta"]], axis=-1, out=out[..., 2])
+        np.sum(psd[..., bands["delta"]], axis=-1, out=out[..., 3])
+
+        out[..., 4] = 0
+        np.divide(energy_alpha, energy_beta, out=out[..., 4], where=energy_beta != 0)
+        return out
+
+    def calculate_spectral_features(self, psd, layout, out, workspace):
+        freqs = layout["freqs"]
+        np.argmax(psd, axis=-1, out=workspace.peak)
+        np.take(freqs, workspace.peak, out=out[..., 5])
+        np.matmul(psd, freqs, out=out[..., 6])
+        out[..., 6] /= np.sum(psd, axis=-1, out=workspace.total_power)
+        # Closed-form least squares slope of log(psd) against log(freq)
+        log_psd = np.log(psd, out=workspace.log_psd)
+        log_psd[..., 0] = 0
+        np.matmul(log_psd, layout["slope_weights"], out=out[..., 7])
+        out[..., 7] /= layout["slope_denominator"]
+        return out
+
+    def calculate_std(self, data, length, workspace, out):
+        # np.std of data[..., :length] without its temporaries; data has the
+        # workspace's shape
+        np.sum(data[..., :length], axis=-1, out=out)
+        out /= length
+        np.copyto(workspace.fill, out[..., np.newaxis])
+        scratch = np.subtract(data, workspace.fill, out=workspace.scratch)
+        np.square(scratch, out=scratch)
+        np.sum(scratch[..., :length], axis=-1, out=out)
+        out /= length
+        return np.sqrt(out, out=out)
+
+    def calculate_temporal_features(self, data, out, workspace):
+        n = data.shape[-1]
+        scratch = workspace.scratch
+        # first_diff[..., :n - 1] and second_diff[..., :n - 2] hold the diffs
+        flat = data.reshape(-1)
+        first_diff = workspace.first_diff.reshape(-1)
+        np.subtract(flat[1:], flat[:-1], out=first_diff[:-1])
+        second_diff = workspace.second_diff.reshape(-1)
+        np.subtract(first_diff[1:], first_diff[:-1], out=second_diff[:-1])
+        std = self.calculate_std(data, n, workspace, workspace.std)
+        first_diff_std = self.calculate_std(workspace.first_diff, n - 1, workspace, workspace.first_diff_std)
+        second_diff_std = self.calculate_std(workspace.second_diff, n - 2, workspace, workspace.second_diff_std)
+
+        np.mean(data, axis=-1, out=out[..., 8])
+        np.square(std, out=out[..., 9])
+        np.square(data, out=scratch)
+        np.sqrt(np.mean(scratch, axis=-1, out=out[..., 10]), out=out[..., 10])
+        # Sign changes, counted in float so the sum needs no cast:
+        # min(|sign[i + 1] - sign[i]|, 1) is 1 exactly where the sign changes
+        np.sign(data, out=scratch)
+        signs = scratch.reshape(-1)
+        crossings = workspace.crossings.reshape(-1)
+        np.subtract(signs[1:], signs[:-1], out=crossings[:-1])
+        np.abs(crossings, out=crossings)
+        np.minimum(crossings, 1, out=crossings)
+        np.sum(workspace.crossings[..., :n - 1], axis=-1, out=out[..., 11])
+        mobility = np.divide(first_diff_std, std, out=out[..., 12])
+        np.divide(second_diff_std, first_diff_std, out=out[..., 13])
+        out[..., 13] /= mobility
+        return out
+
+    def calculate_feature_matrix(self, data, out=None, workspace=None):
+        # Returns (..., 14) features for data of shape (..., samples) with a
+        # single periodogram shared by the PSD and spectral features.
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        layout = self.spectrum_layout(data.shape[-1])
+        workspace = workspace or FeatureWorkspace(data.shape, layout)
+        if out is None:
+            out = np.empty(data.shape[:-1] + (len(self.COLUMNS),), dtype=np.float64)
+        psd = self.calculate_psd(data, workspace)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.calculate_psd_features(psd, layout, out)
+            self.calculate_spectral_features(psd, layout, out, workspace)
+            self.calculate_temporal_features(data, out, workspace)
+        return out
+
+    def calculate_features_into(self, data, out):
+        # calculate_features for C-contiguous float64 windows without array
+        # allocations: fills out, a flat float64 array of channels * 14
+        # values, using a workspace cached for the window shape. Not thread
+        # safe; every thread uses its own FeatureExtractor.
+        features = out.reshape(data.shape[:-1] + (len(self.COLUMNS),))
+        self.calculate_feature_matrix(data, features, self.workspace(data.shape))
+        return out
+
     def calculate_features(self,data):
-        psd_features = self.calculate_psd_features(data)
-        spectral_features = self.calculate_spectral_features(data)
-        temporal_features = self.calculate_temporal_features(data)
-        
-        features =  {**psd_features, **spectral_features, **temporal_features}
-        features_row = []
-        
-        for key in self.COLUMNS:
-            features_row.append(features[key])
-        return features_row, self.COLUMNS
-    
\ No newline at end of file
+        # Returns a flat feature row: 14 values for a single channel, or
+        # channels * 14 values (channel-major) for a (channels, samples) window.
+        data = np.asarray(data, dtype=np.float64)
+        features_row = np.empty(data.size // data.shape[-1] * len(self.COLUMNS))
+        self.calculate_features_into(data, features_row)
+        channels = data.shape[0] if data.ndim == 2 else None
+        return features_row.tolist(), self.feature_columns(channels)
+
+    def calculate_features_batch(self, windows):
+        # windows: (N, samples) -> (N, 14), or (N, channels, samples) ->
+        # (N, channels * 14) with the same column order as calculate_features.
+        # The workspace is cached too: batch scoring repeats the same batch
+        # shape, and allocating fresh arrays costs more than the features.
+        windows = np.asarray(windows, dtype=np.float64)
+        features = self.calculate_feature_matrix(windows, workspace=self.workspace(windows.shape))
+        return features.reshape(windows.shape[0], -1)
+
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import warnings
+import numpy as np
+from utils.constants import MODEL_DIR
+from utils.util_func import artifact_manifest_path
+
+ARTIFACT_FORMAT = "bci-model"
+ARTIFACT_VERSION = 1
+# Predictions of up to this many rows reuse a per-thread kernel buffer
+KERNEL_BUFFER_ROWS = int(os.environ.get("KERNEL_BUFFER_ROWS", 16))
+
+# A model is stored as plain arrays plus a JSON manifest, so it can be
+# loaded without unpickling and independently of the sklearn version:
+#   {MODEL_DIR}/{email}.model.json        manifest, replaced atomically
+#   {MODEL_DIR}/{email}/{version}/*.npy   arrays referenced by the manifest
+# Arrays are memory-mapped on load, so worker processes serving the same
+# user share their pages.
+
+
+def export_model(model, scaler):
+    arrays = {
+        "scaler_mean": scaler.mean_,
+        "scaler_scale": scaler.scale_,
+    }
+    classes = [int(label) for label in model.classes_]
+    if len(classes) != 2:
+        raise ValueError("Only binary models can be exported")
+
+    name = type(model).__name__
+    if hasattr(model, "support_vectors_"):
+        # Decided by the fitted Platt parameters: the constructor flag is
+        # the truthy 'deprecated' by default in sklearn 1.9, which also
+        # warns on reading them
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            prob_a = getattr(model, "probA_", np.empty(0))
+            prob_b = getattr(model, "probB_", np.empty(0))
+        spec = {
+            "kind": "kernel_svm",
+            "kernel": model.kernel,
+            "gamma": float(model._gamma),
+            "coef0": float(model.coef0),
+            "degree": int(model.degree),
+            "probability": bool(np.size(prob_a)),
+        }
+        arrays["support_vectors"] = model.support_vectors_
+        arrays["support_vectors_sq_norm"] = np.einsum("ij,ij->i", model.support_vectors_, model.support_vectors_)
+        arrays["dual_coef"] = model.dual_coef_[0]
+        arrays["intercept"] = model.intercept_
+        if spec["probability"]:
+            arrays["prob_a"] = prob_a
+            arrays["prob_b"] = prob_b
+    elif hasattr(model, "coef_"):
+        spec = {
+            "kind": "linear",
+            "probability": name == "LogisticRegression" or getattr(model, "loss", None) == "log_loss",
+        }
+        arrays["coef"] = model.coef_[0]
+        arrays["intercept"] = model.intercept_
+    else:
+        raise ValueError(f"Cannot export {name}")
+
+    spec.update({"estimator": name, "classes": classes, "n_features": int(scaler.mean_.shape[0])})
+    return spec, arrays
+
+
+def save_artifact(email, model, scaler, metadata=None, state=None):
+    # state: extra arrays needed to resume training (e.g. online models)
+    spec, arrays = export_model(model, scaler)
+    arrays.update(state or {})
+
+    version = f"v{time.time_ns()}"
+    user_dir = os.path.join(MODEL_DIR, email)
+    version_dir = os.path.join(user_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(version_dir, f"{name}.npy"), np.ascontiguousarray(array, dtype=np.float64))
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "format_version": ARTIFACT_VERSION,
+        **spec,
+        "arrays": {name: os.path.join(email, version, f"{name}.npy") for name in arrays},
+        "metadata": metadata or {},
+        "created_at": time.time(),
+    }
+    manifest_path = artifact_manifest_path(email)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, default=str)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # Keep the previous version for readers that still have it mapped
+    versions = sorted(entry for entry in os.listdir(user_dir) if entry.startswith("v"))
+    for old_version in versions[:-2]:
+        shutil.rmtree(os.path.join(user_dir, old_version), ignore_errors=True)
+    return manifest
+
+
+def read_manifest(email):
+    with open(artifact_manifest_path(email)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ARTIFACT_FORMAT or manifest.get("format_version") != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported model artifact for {email}")
+    return manifest
+
+
+def load_arrays(manifest):
+    return {name: np.load(os.path.join(MODEL_DIR, path), mmap_mode="r")
+            for name, path in manifest["arrays"].items()}
+
+
+def sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+def pairwise_to_proba(r01, max_iter=100, eps=0.0025, min_prob=1e-7):
+    # libsvm's multiclass_probability for two classes, vectorized over
+    # samples, so probabilities match sklearn's SVC.predict_proba.
+    r01 = np.clip(r01, min_prob, 1 - min_prob)
+    r10 = 1 - r01
+    Q = np.empty((len(r01), 2, 2))
+    Q[:, 0, 0] = r10 * r10
+    Q[:, 1, 1] = r01 * r01
+    Q[:, 0, 1] = Q[:, 1, 0] = -r10 * r01
+    p = np.full((len(r01), 2), 0.5)
+    active = np.ones(len(r01), dtype=bool)
+    for _ in range(max_iter):
+        Qp = np.einsum("nij,nj->ni", Q, p)
+        pQp = np.einsum("ni,ni->n", p, Qp)
+        active &= np.abs(Qp - pQp[:, None]).max(axis=1) >= eps
+        if not active.any():
+            break
+        for t in range(2):
+            diff = np.where(active, (pQp - Qp[:, t]) / Q[:, t, t], 0.0)
+            p[:, t] += diff
+            pQp = (pQp + diff * (diff * Q[:, t, t] + 2 * Qp[:, t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff[:, None] * Q[:, t, :]) / (1 + diff)[:, None]
+            p /= (1 + diff)[:, None]
+    return p
+
+
+class ArtifactScaler:
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+        self.n_features_in_ = mean.shape[0]
+
+    def transform(self, X, copy=True):
+        # copy=False scales a float64 array in place, like StandardScaler
+        X = np.array(X, dtype=np.float64) if copy else np.asarray(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class ArtifactModel:
+    # Pure NumPy replacement for the fitted sklearn estimator
+    def __init__(self, manifest, arrays):
+        self.manifest = manifest
+        self.arrays = arrays
+        self.kind = manifest["kind"]
+        self.classes_ = np.array(manifest["classes"])
+        self.metadata = manifest.get("metadata", {})
+        self.nbytes = sum(array.nbytes for array in arrays.values())
+        # Per-thread kernel rows for live prediction, which scores a window
+        # or a few at a time; the model itself is shared between threads
+        self.local = threading.local()
+
+    def kernel_buffer(self, n):
+        if n > KERNEL_BUFFER_ROWS:
+            return None
+        buffer = getattr(self.local, "kernel", None)
+        if buffer is None or buffer.shape[0] != n:
+            buffer = self.local.kernel = np.empty((n, self.arrays["support_vectors"].shape[0]))
+        return buffer
+
+    def kernel(self, X, out=None):
+        # Computed in place in out (or a new array) to avoid temporaries of
+        # the (samples, support vectors) size
+        sv = self.arrays["support_vectors"]
+        kernel = self.manifest["kernel"]
+        gamma = self.manifest["gamma"]
+        if kernel not in ("rbf", "linear", "poly", "sigmoid"):
+            raise ValueError(f"Unsupported kernel {kernel}")
+        out = np.matmul(X, sv.T, out=out)
+        if kernel == "rbf":
+            # Squared distances |x|^2 + |sv|^2 - 2 x.sv
+            out *= -2
+            out += self.arrays["support_vectors_sq_norm"]
+            out += np.einsum("ij,ij->i", X, X)[:, None]
+            np.maximum(out, 0, out=out)
+            out *= -gamma
+            np.exp(out, out=out)
+        elif kernel == "poly":
+            out *= gamma
+            out += self.manifest["coef0"]
+            np.power(out, self.manifest["degree"], out=out)
+        elif kernel == "sigmoid":
+            out *= gamma
+            out += self.manifest["coef0"]
+            np.tanh(out, out=out)
+        return out
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.kind == "kernel_svm":
+            decision = self.kernel(X, out=self.kernel_buffer(len(X))) @ self.arrays["dual_coef"]
+        else:
+            decision = X @ self.arrays["coef"]
+        decision += self.arrays["intercept"][0]
+        return decision
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(np.intp)]
+
+    def predict_proba(self, X):
+        # Artifacts exported from an SVC left at sklearn 1.9's
+        # probability='deprecated' claim probabilities without Platt arrays
+        if not self.manifest.get("probability") or (self.kind == "kernel_svm" and not self.arrays["prob_a"].size):
+            raise ValueError("Model was trained without probability estimates")
+        decision = self.decision_function(X)
+        if self.kind == "kernel_svm":
+            # libsvm works with the negated decision value of sklearn
+            r01 = 1 / (1 + np.exp(-decision * self.arrays["prob_a"][0] + self.arrays["prob_b"][0]))
+            return pairwise_to_proba(r01)
+        positive = sigmoid(decision)
+        return np.column_stack([1 - positive, positive])
+
+
+def load_artifact(email):
+    manifest = read_manifest(email)
+    arrays = load_arrays(manifest)
+    model = ArtifactModel(manifest, arrays)
+    scaler = ArtifactScaler(arrays["scaler_mean"], arrays["scaler_scale"])
+    return model, scaler
+
+
+if __name__ == "__main__":
+    # Convert legacy pickled models: python -m services.model_artifact user@example.com ...
+    import pickle
+    from utils.util_func import model_paths
+
+    for email in sys.argv[1:]:
+        model_path, scaler_path = model_paths(email)
+        with open(model_path, "rb") as f:
+            model = pickle.load(f)
+        with open(scaler_path, "rb") as f:
+            scaler = pickle.load(f)
+        save_artifact(email, model, scaler, {"estimator": type(model).__name__, "converted_from": model_path})
+        print(f"Converted {email}")
@@ -1,8 +1,11 @@
-import joblib
+import numpy as np
 from .data_preprocessor import PreprocessEEG
 from .feature_selection import FeatureExtractor
 from .eeg_collect import SensorReader
+from .model_artifact import load_artifact
+from utils.util_func import model_paths, artifact_manifest_path
 import pickle
+import os
 
 sensor_reader = SensorReader(port='COM3')
 preprocessor = PreprocessEEG()
@@ -17,35 +20,53 @@ class ModelPredict:
     
     def load_model(self,email):
         self.email = email
-        with open(f'models/{self.email}.pkl', 'rb') as f:
+        if os.path.exists(artifact_manifest_path(email)):
+            self.model, self.scaler = load_artifact(email)
+            return
+        # Models saved before the artifact format; convert them with
+        # python -m services.model_artifact <email>
+        model_path, scaler_path = model_paths(email)
+        with open(model_path, 'rb') as f:
             self.model = pickle.load(f)
-        with open(f'models/{self.email}_scaler.pkl', 'rb') as f:
+        with open(scaler_path, 'rb') as f:
             self.scaler = pickle.load(f)
             
-    def predict(self, X):
-        X_scaled = self.scaler.transform(X)
+    @property
+    def n_channels(self):
+        # Models are trained on 14 features per channel; older models only
+        # used the first channel.
+        return self.scaler.n_features_in_ // len(feature_extractor.COLUMNS)
+
+    def predict(self, X, out=None):
+        # X is a (windows, features) float64 array. With out, a float64
+        # array of the same shape owned by the caller, the features are
+        # scaled there in place instead of into a new array.
+        if out is None:
+            X_scaled = self.scaler.transform(np.asarray(X, dtype=np.float64))
+        else:
+            np.copyto(out, X)
+            X_scaled = self.scaler.transform(out, copy=False)
         return self.model.predict(X_scaled)
 
 if __name__ == '__main__':
+    # python -m services.model_predict user@example.com
+    import sys
 
-    model=ModelPredict("ali@gmail.com")
-    sensor_reader.connect()
+    model = ModelPredict()
+    model.load_model(email=sys.argv[1])
+    if not sensor_reader.connect():
+        sys.exit(1)
     sensor_reader.start_reading()
+    n_channels = model.n_channels
+    features = np.empty((1, n_channels * len(feature_extractor.COLUMNS)))
+    scaled = np.empty_like(features)
     try:
-        model.load_model()
-        while True:
-            generator_data = sensor_reader.read_one_second_data()
-            data = list(next(generator_data, []))
-            print(data)
-            preprocessed_data = preprocessor.preprocess(data)
-            feature = feature_extractor.calculate_features(preprocessed_data)
-            prediction = model.predict([list(feature.values())])
-            if prediction == 0:
-                prediction = "Relaxing"
-            else:
-                prediction = "Focused"
-            print(f"Prediction: {prediction}")    
+        for data in sensor_reader.read_one_second_data():
+            preprocessed_data = preprocessor.preprocess_chunk(data)
+            feature_extractor.calculate_features_into(preprocessed_data[:n_channels], features[0])
+            prediction = model.predict(features, out=scaled)[0]
+            print(f"Prediction: {'Relaxing' if prediction == 0 else 'Focused'}")
     except KeyboardInterrupt:
         sensor_reader.stop_reading()
         sensor_reader.disconnect()
-        print("Disconnected")        
\ No newline at end of file
+        print("Disconnected")
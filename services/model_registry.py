@@ -0,0 +1,151 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from .model_predict import ModelPredict
+from utils.util_func import model_files
+from utils.metrics import registry
+
+MODEL_CACHE_ENTRIES = int(os.environ.get("MODEL_CACHE_ENTRIES", 32))
+MODEL_CACHE_MB = float(os.environ.get("MODEL_CACHE_MB", 256))
+MODEL_CACHE_CHECKSUM = os.environ.get("MODEL_CACHE_CHECKSUM", "0") == "1"
+
+
+class CachedModel:
+    def __init__(self, model, signature, checksum, size):
+        self.model = model
+        self.signature = signature
+        self.checksum = checksum
+        self.size = size
+
+
+class LoadLock:
+    # Per-user load lock, kept while any thread holds or waits on it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class ModelRegistry:
+    # Process-wide cache of loaded per-user models. Entries are evicted in
+    # least recently used order once either cap is exceeded, and reloaded
+    # when the files on disk change (e.g. after a retrain).
+    def __init__(self, max_entries=MODEL_CACHE_ENTRIES, max_bytes=MODEL_CACHE_MB * 1024 * 1024,
+                 verify_checksum=MODEL_CACHE_CHECKSUM):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.verify_checksum = verify_checksum
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.load_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def signature(self, email):
+        stats = [os.stat(path) for path in model_files(email)]
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+    def checksum(self, email):
+        digest = hashlib.sha256()
+        for path in model_files(email):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def _lookup(self, email, signature):
+        entry = self.entries.get(email)
+        if entry is None:
+            return None
+        if entry.signature != signature:
+            # The files were touched; with checksums enabled an identical
+            # rewrite keeps the loaded model.
+            if not self.verify_checksum or entry.checksum != self.checksum(email):
+                return None
+            entry.signature = signature
+        self.entries.move_to_end(email)
+        self.hits += 1
+        return entry.model
+
+    def get(self, email):
+        signature = self.signature(email)
+        with self.lock:
+            model = self._lookup(email, signature)
+            if model is not None:
+                return model
+            load_lock = self.load_locks.get(email)
+            if load_lock is None:
+                load_lock = self.load_locks[email] = LoadLock()
+            load_lock.users += 1
+
+        # Concurrent requests for the same user wait here and reuse the
+        # first one's result, so each model is loaded only once. The lock
+        # is dropped by the last thread using it, whether or not the load
+        # succeeded.
+        try:
+            with load_lock.lock:
+                return self._load(email, signature)
+        finally:
+            with self.lock:
+                load_lock.users -= 1
+                if not load_lock.users:
+                    del self.load_locks[email]
+
+    def _load(self, email, signature):
+        with self.lock:
+            model = self._lookup(email, signature)
+            if model is not None:
+                return model
+            self.misses += 1
+
+        model = ModelPredict()
+        model.load_model(email=email)
+        checksum = self.checksum(email) if self.verify_checksum else None
+        # Artifacts are memory-mapped, so count their arrays rather than
+        # the manifest file
+        size = getattr(model.model, "nbytes", None) or sum(size for _, size in signature)
+
+        with self.lock:
+            self._remove(email)
+            self.entries[email] = CachedModel(model, signature, checksum, size)
+            self.total_bytes += size
+            self._evict()
+        return model
+
+    def _remove(self, email):
+        entry = self.entries.pop(email, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _evict(self):
+        # The most recently used entry is always kept, even if it alone
+        # exceeds the byte cap.
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            email, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            self.evictions += 1
+
+    def invalidate(self, email):
+        with self.lock:
+            self._remove(email)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+model_registry = ModelRegistry()
+
+registry.gauge("bci_model_cache_entries", "Models loaded in memory", lambda: model_registry.stats()["entries"])
+registry.gauge("bci_model_cache_bytes", "Estimated size of loaded models", lambda: model_registry.stats()["bytes"])
+for key, documentation in (("hits", "Model cache hits"), ("misses", "Model cache misses"),
+                           ("evictions", "Models evicted from the cache")):
+    registry.gauge(f"bci_model_cache_{key}_total", documentation, lambda key=key: model_registry.stats()[key],
+                   kind="counter")
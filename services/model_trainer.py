@@ -1,10 +1,31 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
+import numpy as np
+from sklearn.model_selection import train_test_split, GridSearchCV, StratifiedKFold
 from sklearn.svm import SVC
+from sklearn.linear_model import LogisticRegression
+from sklearn.base import clone
 from sklearn.metrics import accuracy_score,classification_report,confusion_matrix
 from sklearn.preprocessing import StandardScaler
 import joblib
-import pickle
+import time
+import os
+from .model_artifact import save_artifact
+from .training_jobs import TRAINING_WORKERS
+
+MODEL_TUNING = os.environ.get("MODEL_TUNING", "0") == "1"
+MODEL_LATENCY_BUDGET_MS = float(os.environ.get("MODEL_LATENCY_BUDGET_MS", 5.0))
+MODEL_TUNING_FOLDS = int(os.environ.get("MODEL_TUNING_FOLDS", 5))
+# Searches run inside the training pool's worker processes, so each one
+# only gets its share of the cores
+MODEL_TUNING_JOBS = int(os.environ.get("MODEL_TUNING_JOBS", max(1, (os.cpu_count() or 1) // TRAINING_WORKERS)))
+
+# Candidates for Model.tune. probability=False during the search avoids
+# libsvm's internal 5-fold Platt calibration for every candidate; only the
+# chosen SVC is refit with probabilities.
+SEARCH_SPACE = [
+    (SVC(kernel='rbf'), {"C": [1, 10, 100, 1000], "gamma": ['scale', 'auto', 0.01, 0.1]}),
+    (SVC(kernel='linear'), {"C": [0.1, 1, 10]}),
+    (LogisticRegression(max_iter=1000), {"C": [0.1, 1, 10]}),
+]
 
 class Model:
     def __init__(self):
@@ -13,46 +34,101 @@ class Model:
         self.kernel = 'rbf'
         self.model = SVC(C=self.C, gamma=self.gamma, kernel=self.kernel,probability=True)
         self.scaler = StandardScaler()
+        self.metadata = {}
     
     def train_with_split(self,X,y):
         data = self.scale_data(X)
         X_train, X_test, y_train, y_test = train_test_split(data, y, test_size=0.2, random_state=42)
+        started = time.perf_counter()
         self.model.fit(X_train, y_train)
-        return self.evaluate(X_test, y_test)
+        self.metadata = {
+            "estimator": type(self.model).__name__,
+            "params": self.model.get_params(),
+            "fit_seconds": time.perf_counter() - started,
+            "samples": len(y_train),
+        }
+        return self.evaluate(X_test, y_test, scaled=True)
+
+    def tune(self, X, y, latency_budget_ms=MODEL_LATENCY_BUDGET_MS, folds=MODEL_TUNING_FOLDS,
+             n_jobs=MODEL_TUNING_JOBS):
+        # Cross-validated search over SEARCH_SPACE with n_jobs processes.
+        # The feature matrix is loaded and scaled once and shared by every
+        # candidate. The most accurate candidate whose single-window
+        # prediction fits in the latency budget wins; if none does, the
+        # fastest one.
+        started = time.perf_counter()
+        data = self.scale_data(X)
+        y = np.asarray(y).ravel()
+        cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+
+        candidates = []
+        for estimator, grid in SEARCH_SPACE:
+            search = GridSearchCV(estimator, grid, cv=cv, scoring='accuracy', n_jobs=n_jobs, refit=False)
+            search.fit(data, y)
+            results = search.cv_results_
+            for params, score in zip(results["params"], results["mean_test_score"]):
+                candidates.append((float(score), estimator, params))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        chosen = None
+        for score, estimator, params in candidates:
+            model = clone(estimator).set_params(**params)
+            if isinstance(model, SVC):
+                model.set_params(probability=True)
+            fit_started = time.perf_counter()
+            model.fit(data, y)
+            candidate = {"model": model, "params": params, "cv_accuracy": score,
+                         "fit_seconds": time.perf_counter() - fit_started,
+                         "latency_ms": self.measure_latency(model, data[:1])}
+            if candidate["latency_ms"] <= latency_budget_ms:
+                chosen = candidate
+                break
+            if chosen is None or candidate["latency_ms"] < chosen["latency_ms"]:
+                chosen = candidate
+
+        self.model = chosen.pop("model")
+        self.metadata = {
+            "estimator": type(self.model).__name__,
+            **chosen,
+            "latency_budget_ms": latency_budget_ms,
+            "candidates": len(candidates),
+            "tuning_seconds": time.perf_counter() - started,
+            "samples": len(y),
+        }
+        return self.metadata
+
+    def measure_latency(self, model, window, repeats=50):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model.predict(window)
+            timings.append(time.perf_counter() - started)
+        return float(np.median(timings) * 1000)
     
     def train(self,X,y):
-        data = pd.DataFrame(X).values
-        label = pd.DataFrame(y).values
-        data = self.scale_data(data)
-        self.model.fit(data, label)
+        data = self.scale_data(X)
+        self.model.fit(data, np.asarray(y).ravel())
         return True
     
     def predict(self, X):
-        X = pd.DataFrame(X).values
-        X = self.scale_data(X)
+        X = self.scaler.transform(np.asarray(X, dtype=np.float64))
         
         return self.model.predict(X)
     
-    def evaluate(self, X, y):
-        y_pred = self.predict(X)
+    def evaluate(self, X, y, scaled=False):
+        y_pred = self.model.predict(X) if scaled else self.predict(X)
         accuracy = accuracy_score(y, y_pred)
         report = classification_report(y, y_pred)
         matrix = confusion_matrix(y, y_pred)
         
         return accuracy, report, matrix
     
-    def scale_data(self,X:pd.DataFrame):
-        return self.scaler.fit_transform(X)
+    def scale_data(self,X:np.ndarray):
+        # Training sets are loaded as float32; scaling and fitting run in
+        # float64 like prediction does
+        return self.scaler.fit_transform(np.asarray(X, dtype=np.float64))
     
     def save_model(self,email):
-        model_filename = f'models/{email}.pkl'
-
-        with open(model_filename, 'wb') as file:
-            pickle.dump(self.model, file)
-
-        scaler_filename = f'models/{email}_scaler.pkl'
-
-        with open(scaler_filename, 'wb') as file:
-            pickle.dump(self.scaler, file)
+        save_artifact(email, self.model, self.scaler, self.metadata)
         return True
         
\ No newline at end of file
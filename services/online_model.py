@@ -0,0 +1,75 @@
+import time
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from .model_artifact import save_artifact, read_manifest, load_arrays
+
+CLASSES = np.array([0, 1])
+
+
+class OnlineModel:
+    # Logistic regression trained with SGD whose scaler and weights are both
+    # updated with partial_fit, so new labelled windows can be folded into
+    # the stored model without revisiting a user's history.
+    def __init__(self):
+        self.model = SGDClassifier(loss='log_loss', alpha=1e-4, random_state=42)
+        self.scaler = StandardScaler()
+        self.metadata = {"estimator": "SGDClassifier", "online": True, "updates": 0, "samples_seen": 0}
+
+    def update(self, X, y):
+        started = time.perf_counter()
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y).ravel()
+        self.scaler.partial_fit(X)
+        self.model.partial_fit(self.scaler.transform(X), y, classes=CLASSES)
+
+        self.metadata["updates"] += 1
+        self.metadata["samples_seen"] += len(y)
+        self.metadata["last_update_samples"] = len(y)
+        self.metadata["last_update_seconds"] = time.perf_counter() - started
+        self.metadata["updated_at"] = time.time()
+        return self.metadata
+
+    def predict(self, X):
+        return self.model.predict(self.scaler.transform(np.asarray(X, dtype=np.float64)))
+
+    def save_model(self, email):
+        # Same artifact as Model.save_model, so ModelPredict and the model
+        # registry load it like any other user model; the extra arrays let
+        # load_model resume training exactly where it stopped
+        state = {
+            "scaler_var": self.scaler.var_,
+            "scaler_samples_seen": np.atleast_1d(self.scaler.n_samples_seen_),
+            "sgd_t": np.array([self.model.t_]),
+        }
+        save_artifact(email, self.model, self.scaler, self.metadata, state)
+        return True
+
+    @classmethod
+    def load_model(cls, email):
+        # Returns None when the user's stored model is not an online model
+        try:
+            manifest = read_manifest(email)
+        except FileNotFoundError:
+            return None
+        if not manifest["metadata"].get("online"):
+            return None
+
+        arrays = {name: np.array(array) for name, array in load_arrays(manifest).items()}
+        online_model = cls()
+        scaler = online_model.scaler
+        scaler.mean_ = arrays["scaler_mean"]
+        scaler.var_ = arrays["scaler_var"]
+        scaler.scale_ = arrays["scaler_scale"]
+        samples_seen = arrays["scaler_samples_seen"].astype(np.int64)
+        scaler.n_samples_seen_ = samples_seen[0] if len(samples_seen) == 1 else samples_seen
+        scaler.n_features_in_ = len(scaler.mean_)
+
+        model = online_model.model
+        model.coef_ = arrays["coef"].reshape(1, -1)
+        model.intercept_ = arrays["intercept"]
+        model.classes_ = np.array(manifest["classes"])
+        model.t_ = float(arrays["sgd_t"][0])
+        model.n_features_in_ = len(scaler.mean_)
+        online_model.metadata = manifest["metadata"]
+        return online_model
@@ -0,0 +1,290 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+import numpy as np
+from .data_preprocessor import PreprocessEEG
+from .feature_selection import FeatureExtractor
+from .stream_engine import RingBuffer, SlidingWindowEngine
+from utils.metrics import (registry, stage_seconds, samples_total, windows_total, windows_skipped_total,
+                           record_device_counters)
+
+PREDICTION_WINDOW = float(os.environ.get("PREDICTION_WINDOW", 1.0))  # seconds
+PREDICTION_HOP = float(os.environ.get("PREDICTION_HOP", 0.25))  # seconds
+PREDICTION_VOTES = int(os.environ.get("PREDICTION_VOTES", 5))
+PREDICTION_OUTPUT_QUEUE = int(os.environ.get("PREDICTION_OUTPUT_QUEUE", 32))
+
+
+class PredictionSession:
+    # One headset streaming into one user's model: owns the device handle,
+    # the acquisition and inference threads, and the asyncio output queue
+    # its websocket reads from.
+    def __init__(self, email, sensor_reader, model, window=PREDICTION_WINDOW, hop=PREDICTION_HOP, votes=PREDICTION_VOTES):
+        self.email = email
+        self.sensor_reader = sensor_reader
+        self.model = model
+        self.window = int(window * sensor_reader.FREQ)
+        self.hop = max(1, int(hop * sensor_reader.FREQ))
+        self.votes = votes
+        self.loop = None
+        self.outputs = None
+        self.dropped_outputs = 0
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.buffer = None
+        self.engine = None
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.predictions = 0
+        self.acquisition_cpu_seconds = 0.0
+        self.inference_cpu_seconds = 0.0
+
+    @property
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def attach(self, loop, maxsize=PREDICTION_OUTPUT_QUEUE):
+        # Must be called from the event loop that consumes self.outputs. A
+        # session has a single consumer; returns False once one is attached.
+        if self.outputs is not None:
+            return False
+        self.loop = loop
+        self.outputs = asyncio.Queue(maxsize=maxsize)
+        return True
+
+    def _deliver(self, item):
+        # Runs on the event loop. A slow client loses the oldest predictions
+        # rather than letting the queue grow without bound.
+        if self.outputs.full():
+            self.outputs.get_nowait()
+            self.dropped_outputs += 1
+        self.outputs.put_nowait(item)
+
+    def publish(self, item):
+        if self.loop is None:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, item)
+        except RuntimeError:
+            # The event loop has already been closed
+            pass
+
+    def start(self):
+        if self.is_running:
+            return False
+        self.stop_event.clear()
+        self.buffer = RingBuffer(capacity=max(4 * self.window, self.window + 2 * self.sensor_reader.FREQ),
+                                 channels=self.sensor_reader.channels)
+        self.engine = SlidingWindowEngine(self.buffer, window=self.window, hop=self.hop)
+        self.started_at = time.time()
+        self.threads = [
+            threading.Thread(target=self.acquire, name=f"acquire-{self.email}", daemon=True),
+            threading.Thread(target=self.predict, name=f"predict-{self.email}", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.buffer is not None:
+            self.buffer.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+
+    def close(self):
+        self.stop()
+        self.sensor_reader.stop_reading()
+        self.sensor_reader.disconnect()
+
+    def acquire(self):
+        # Samples are filtered once as they arrive, so windows in the ring
+        # buffer are ready for feature extraction.
+        preprocessor = PreprocessEEG(sampling_rate=self.sensor_reader.FREQ)
+        # Serial read time includes waiting for the headset
+        read_seconds = stage_seconds.labels(pipeline="prediction", stage="serial_read")
+        preprocess_seconds = stage_seconds.labels(pipeline="prediction", stage="preprocess")
+        samples = samples_total.labels(pipeline="prediction")
+        reported = {}
+        try:
+            while not self.stop_event.is_set() and self.sensor_reader.is_open:
+                started = time.perf_counter()
+                block = self.sensor_reader.read_block()
+                read_seconds.observe(time.perf_counter() - started)
+                if block.shape[1]:
+                    started = time.thread_time()
+                    preprocess_started = time.perf_counter()
+                    filtered = preprocessor.preprocess_chunk(block)
+                    preprocess_seconds.observe(time.perf_counter() - preprocess_started)
+                    self.buffer.write(filtered)
+                    samples.inc(block.shape[1])
+                    record_device_counters("prediction", self.sensor_reader, preprocessor, reported)
+                    self.acquisition_cpu_seconds += time.thread_time() - started
+        except Exception as e:
+            print(f"Error in acquisition for {self.email}: {e}")
+        finally:
+            self.buffer.close()
+
+    def predict(self):
+        feature_extractor = FeatureExtractor(sampling_rate=self.sensor_reader.FREQ)
+        n_channels = self.model.n_channels
+        features_seconds = stage_seconds.labels(pipeline="prediction", stage="features")
+        predict_seconds = stage_seconds.labels(pipeline="prediction", stage="predict")
+        windows = windows_total.labels(pipeline="prediction")
+        windows_skipped = windows_skipped_total.labels()
+        reported_skipped = 0
+
+        # Majority vote over the most recent windows, updated on every hop
+        predictions = deque(maxlen=self.votes)
+        # Every window goes through the same float64 arrays: the engine's
+        # window, the extractor's workspace and these feature rows
+        features = np.empty((1, n_channels * len(feature_extractor.COLUMNS)))
+        scaled = np.empty_like(features)
+        try:
+            for data in self.engine.windows(self.stop_event):
+                started = time.thread_time()
+                stage_started = time.perf_counter()
+                feature_extractor.calculate_features_into(data[:n_channels], features[0])
+                predict_started = time.perf_counter()
+                features_seconds.observe(predict_started - stage_started)
+                predictions.append(int(self.model.predict(features, out=scaled)[0]))
+                predict_seconds.observe(time.perf_counter() - predict_started)
+                windows.inc()
+                windows_skipped.inc(self.engine.windows_skipped - reported_skipped)
+                reported_skipped = self.engine.windows_skipped
+
+                if predictions.count(0) > predictions.count(1):
+                    prediction = 0
+                else:
+                    prediction = 1
+
+                self.publish("Relaxing" if prediction == 0 else "Focused")
+                self.predictions += 1
+                self.inference_cpu_seconds += time.thread_time() - started
+        except Exception as e:
+            print(f"Error in prediction pipeline for {self.email}: {e}")
+        finally:
+            self.stop_event.set()
+            # Wake the websocket so it stops waiting for predictions
+            self.publish(None)
+            print(f"Stopped prediction pipeline for {self.email}")
+
+    def stats(self):
+        running_for = time.time() - self.started_at if self.started_at else 0.0
+        return {
+            "email": self.email,
+            "port": self.sensor_reader.port,
+            "running": self.is_running,
+            "running_seconds": running_for,
+            "samples_received": self.buffer.total if self.buffer else 0,
+            "dropped_samples": self.sensor_reader.dropped_samples,
+            "windows_skipped": self.engine.windows_skipped if self.engine else 0,
+            "predictions": self.predictions,
+            "pending_outputs": self.outputs.qsize() if self.outputs else 0,
+            "dropped_outputs": self.dropped_outputs,
+            "lag_samples": self.engine.lag() if self.engine else 0,
+            "acquisition_cpu_seconds": self.acquisition_cpu_seconds,
+            "inference_cpu_seconds": self.inference_cpu_seconds,
+            "buffer_bytes": self.buffer.buffer.nbytes if self.buffer else 0,
+        }
+
+
+class SessionManager:
+    def __init__(self):
+        self.sessions = {}
+        self.opening = {}  # email -> port being connected
+        self.lock = threading.Lock()
+
+    def open(self, email, sensor_reader, model):
+        # Replaces any previous session of the same user; a device already
+        # streaming for another user is refused. The port stays reserved
+        # while it is being connected, so two users cannot both open it.
+        with self.lock:
+            ports = {user: session.sensor_reader.port for user, session in self.sessions.items()}
+            ports.update(self.opening)
+            if email in self.opening:
+                return None
+            for other, port in ports.items():
+                if other != email and port == sensor_reader.port:
+                    return None
+            self.opening[email] = sensor_reader.port
+            previous = self.sessions.pop(email, None)
+        try:
+            if previous is not None:
+                previous.close()
+            if not sensor_reader.connect():
+                return None
+            sensor_reader.start_reading()
+            session = PredictionSession(email, sensor_reader, model)
+            with self.lock:
+                self.sessions[email] = session
+            return session
+        finally:
+            with self.lock:
+                self.opening.pop(email, None)
+
+    def get(self, email):
+        with self.lock:
+            return self.sessions.get(email)
+
+    def close(self, email, session=None):
+        # With session, only closes the user's session if it is still that
+        # one, not a newer one opened in the meantime
+        with self.lock:
+            current = self.sessions.get(email)
+            if current is None or (session is not None and current is not session):
+                return False
+            del self.sessions[email]
+        current.close()
+        return True
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        session_stats = [session.stats() for session in sessions]
+        return {
+            "sessions": len(session_stats),
+            "running": sum(1 for stats in session_stats if stats["running"]),
+            "inference_cpu_seconds": sum(stats["inference_cpu_seconds"] for stats in session_stats),
+            "acquisition_cpu_seconds": sum(stats["acquisition_cpu_seconds"] for stats in session_stats),
+            "buffer_bytes": sum(stats["buffer_bytes"] for stats in session_stats),
+            "details": session_stats,
+        }
+
+
+session_manager = SessionManager()
+
+
+# Aggregated over the open sessions: per-session labels would publish user
+# emails on /metrics and grow a series for every session ever opened
+def session_total(key):
+    def collect():
+        return sum(stats[key] for stats in session_manager.stats()["details"])
+    return collect
+
+
+def session_lag_seconds():
+    with session_manager.lock:
+        sessions = list(session_manager.sessions.values())
+    return max((session.engine.lag() / session.sensor_reader.FREQ
+                for session in sessions if session.engine is not None), default=0.0)
+
+
+registry.gauge("bci_session_lag_seconds",
+               "Largest backlog of received samples not yet covered by a prediction window, in seconds",
+               session_lag_seconds)
+registry.gauge("bci_session_output_queue", "Predictions waiting to be sent on the websockets of open sessions",
+               session_total("pending_outputs"))
+registry.gauge("bci_session_dropped_outputs", "Predictions dropped by open sessions because the websocket client was slow",
+               session_total("dropped_outputs"))
+registry.gauge("bci_sessions", "Open prediction sessions", lambda: len(session_manager.sessions))
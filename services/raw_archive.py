@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import numpy as np
+
+RAW_ARCHIVE_DIR = os.environ.get("RAW_ARCHIVE_DIR", "recordings")
+RAW_CHUNK_SAMPLES = int(os.environ.get("RAW_CHUNK_SAMPLES", 2048))
+RAW_COMPRESSION_LEVEL = int(os.environ.get("RAW_COMPRESSION_LEVEL", 6))
+
+# One record per compressed chunk in index.bin
+INDEX_DTYPE = np.dtype([
+    ("start", "<i8"),      # first sample of the chunk within the session
+    ("samples", "<i4"),
+    ("offset", "<i8"),     # byte offset of the chunk in segments.bin
+    ("nbytes", "<i4"),
+])
+
+# Layout of a recorded session:
+#   {root}/{email}/{session_id}/manifest.json
+#   {root}/{email}/{session_id}/segments.bin   concatenated zlib chunks
+#   {root}/{email}/{session_id}/index.bin      INDEX_DTYPE records
+# Chunks hold (channels, samples) int16 data, delta encoded along time
+# before compression.
+
+
+def encode_chunk(block, level=RAW_COMPRESSION_LEVEL):
+    block = np.ascontiguousarray(block, dtype=np.int16)
+    deltas = np.diff(block, axis=1, prepend=np.zeros((block.shape[0], 1), dtype=np.int16))
+    return zlib.compress(deltas.astype("<i2").tobytes(), level)
+
+
+def decode_chunk(data, channels, samples):
+    deltas = np.frombuffer(zlib.decompress(data), dtype="<i2").reshape(channels, samples)
+    return np.cumsum(deltas, axis=1, dtype=np.int16)
+
+
+class RawArchiveWriter:
+    def __init__(self, email, label, channels, sampling_rate=512, session_id=None,
+                 root=RAW_ARCHIVE_DIR, chunk_samples=RAW_CHUNK_SAMPLES):
+        self.session_id = session_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(root, email, self.session_id)
+        os.makedirs(self.path, exist_ok=True)
+        self.channels = channels
+        self.chunk_samples = chunk_samples
+        self.pending = np.empty((channels, chunk_samples), dtype=np.int16)
+        self.pending_samples = 0
+        self.total_samples = 0
+        self.offset = 0
+        self.compressed_bytes = 0
+
+        self.manifest = {
+            "email": email,
+            "session_id": self.session_id,
+            "label": label,
+            "channels": channels,
+            "sampling_rate": sampling_rate,
+            "dtype": "int16",
+            "codec": "zlib-delta",
+            "started_at": time.time(),
+            "samples": 0,
+            "compressed_bytes": 0,
+        }
+        self.write_manifest()
+        self.segments = open(os.path.join(self.path, "segments.bin"), "ab")
+        self.index = open(os.path.join(self.path, "index.bin"), "ab")
+
+    def write_manifest(self):
+        temporary = os.path.join(self.path, "manifest.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(temporary, os.path.join(self.path, "manifest.json"))
+
+    def write(self, block):
+        block = np.asarray(block)
+        position = 0
+        while position < block.shape[1]:
+            n = min(self.chunk_samples - self.pending_samples, block.shape[1] - position)
+            self.pending[:, self.pending_samples:self.pending_samples + n] = block[:, position:position + n]
+            self.pending_samples += n
+            position += n
+            if self.pending_samples == self.chunk_samples:
+                self.flush()
+
+    def flush(self):
+        if not self.pending_samples:
+            return
+        data = encode_chunk(self.pending[:, :self.pending_samples])
+        self.segments.write(data)
+        self.segments.flush()
+        record = np.array([(self.total_samples, self.pending_samples, self.offset, len(data))], dtype=INDEX_DTYPE)
+        self.index.write(record.tobytes())
+        self.index.flush()
+        self.total_samples += self.pending_samples
+        self.offset += len(data)
+        self.compressed_bytes += len(data)
+        self.pending_samples = 0
+
+    def close(self):
+        self.flush()
+        self.segments.close()
+        self.index.close()
+        self.manifest["samples"] = self.total_samples
+        self.manifest["compressed_bytes"] = self.compressed_bytes
+        self.manifest["finished_at"] = time.time()
+        self.write_manifest()
+
+
+class RawSessionReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.channels = self.manifest["channels"]
+        self.sampling_rate = self.manifest["sampling_rate"]
+
+        # Only complete records count, so sessions still being recorded can
+        # be read too.
+        index = np.fromfile(os.path.join(path, "index.bin"), dtype=np.uint8)
+        usable = len(index) - len(index) % INDEX_DTYPE.itemsize
+        self.index = index[:usable].view(INDEX_DTYPE)
+        self.n_samples = int(self.index["start"][-1] + self.index["samples"][-1]) if len(self.index) else 0
+        segments_path = os.path.join(path, "segments.bin")
+        if os.path.getsize(segments_path):
+            self.segments = np.memmap(segments_path, dtype=np.uint8, mode="r")
+        else:
+            self.segments = np.empty(0, dtype=np.uint8)
+        self.cached_chunk = (None, None)
+
+    def chunk(self, i):
+        # The last decoded chunk is kept, since overlapping windows mostly
+        # land in the same chunk
+        if self.cached_chunk[0] == i:
+            return self.cached_chunk[1]
+        record = self.index[i]
+        data = self.segments[record["offset"]:record["offset"] + record["nbytes"]]
+        chunk = decode_chunk(data, self.channels, int(record["samples"]))
+        self.cached_chunk = (i, chunk)
+        return chunk
+
+    def read(self, start=0, stop=None):
+        # Decodes only the chunks overlapping [start, stop)
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        start = max(0, start)
+        out = np.empty((self.channels, max(0, stop - start)), dtype=np.int16)
+        if stop <= start:
+            return out
+        ends = self.index["start"] + self.index["samples"]
+        first = int(np.searchsorted(ends, start, side="right"))
+        last = int(np.searchsorted(self.index["start"], stop, side="left"))
+        for i in range(first, last):
+            chunk_start = int(self.index["start"][i])
+            chunk = self.chunk(i)
+            lo = max(start, chunk_start)
+            hi = min(stop, chunk_start + chunk.shape[1])
+            out[:, lo - start:hi - start] = chunk[:, lo - chunk_start:hi - chunk_start]
+        return out
+
+    def read_seconds(self, start, stop=None):
+        stop_sample = None if stop is None else int(stop * self.sampling_rate)
+        return self.read(int(start * self.sampling_rate), stop_sample)
+
+    def iter_chunks(self, start=0, stop=None, chunk_samples=RAW_CHUNK_SAMPLES):
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        for position in range(start, stop, chunk_samples):
+            yield self.read(position, min(position + chunk_samples, stop))
+
+    def iter_windows(self, window, hop=None, start=0, stop=None):
+        # Streams (channels, window) windows without loading the session
+        hop = hop or window
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        for position in range(start, stop - window + 1, hop):
+            yield self.read(position, position + window)
+
+
+class RawArchive:
+    def __init__(self, root=RAW_ARCHIVE_DIR):
+        self.root = root
+
+    def sessions(self, email, label=None):
+        user_path = os.path.join(self.root, email)
+        if not os.path.isdir(user_path):
+            return []
+        manifests = []
+        for session_id in sorted(os.listdir(user_path)):
+            manifest_path = os.path.join(user_path, session_id, "manifest.json")
+            if not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if label is None or manifest["label"] == label:
+                manifests.append(manifest)
+        return manifests
+
+    def open(self, email, session_id):
+        return RawSessionReader(os.path.join(self.root, email, session_id))
@@ -0,0 +1,143 @@
+import numpy as np
+
+NEWLINE = ord("\n")
+COMMA = ord(",")
+
+# Binary frames sent by the sketch after "binary_mode":
+#   sync word 0xA55A (little endian), uint16 sequence counter,
+#   then one little endian uint16 sample per channel.
+SYNC_WORD = b"\x5a\xa5"
+HEADER_SIZE = 4
+
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+class TextDecoder:
+    def __init__(self, channels=3, block_size=2048):
+        self.channels = channels
+        self.block = np.empty((channels, block_size), dtype=np.int16)
+        self.remainder = b""
+        self.invalid_lines = 0
+        self.dropped_samples = 0
+
+    def _ensure_capacity(self, n):
+        if n > self.block.shape[1]:
+            self.block = np.empty((self.channels, max(n, 2 * self.block.shape[1])), dtype=np.int16)
+
+    def decode(self, data):
+        # Returns a (channels, n) view into a reused int16 block; callers
+        # must copy it before the next call.
+        data = self.remainder + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            self.remainder = data
+            return self.block[:, :0]
+        self.remainder = data[end + 1:]
+        lines = data[:end + 1].replace(b"\r", b"")
+
+        raw = np.frombuffer(lines, dtype=np.uint8)
+        newlines = np.flatnonzero(raw == NEWLINE)
+        commas = np.cumsum(raw == COMMA)[newlines]
+        commas_per_line = np.diff(commas, prepend=0)
+        line_lengths = np.diff(newlines, prepend=-1) - 1
+        n_lines = len(newlines)
+
+        if np.all(commas_per_line == self.channels - 1) and np.all(line_lengths > 0):
+            # fromstring raises on empty or non-numeric fields (4,,6 or
+            # 4,x,6); those chunks and out of range values go the slow way
+            try:
+                values = np.fromstring(lines.replace(b"\n", b","), dtype=np.int32, sep=",")
+            except ValueError:
+                values = None
+            if (values is not None and len(values) == n_lines * self.channels
+                    and values.min() >= INT16_MIN and values.max() <= INT16_MAX):
+                self._ensure_capacity(n_lines)
+                out = self.block[:, :n_lines]
+                out[...] = values.reshape(n_lines, self.channels).T
+                return out
+        return self._decode_slow(lines, n_lines)
+
+    def _decode_slow(self, lines, n_lines):
+        # Fallback for chunks with partial or garbled lines (e.g. boot
+        # messages); only well formed lines are kept.
+        self._ensure_capacity(n_lines)
+        count = 0
+        for line in lines.split(b"\n")[:-1]:
+            parts = line.split(b",")
+            if len(parts) != self.channels:
+                self.invalid_lines += 1
+                continue
+            try:
+                self.block[:, count] = [int(part) for part in parts]
+            except (ValueError, OverflowError):
+                self.invalid_lines += 1
+                continue
+            count += 1
+        return self.block[:, :count]
+
+
+class BinaryDecoder:
+    def __init__(self, channels=3, block_size=2048):
+        self.channels = channels
+        self.frame_size = HEADER_SIZE + 2 * channels
+        self.block = np.empty((channels, block_size), dtype=np.int16)
+        self.remainder = b""
+        self.last_sequence = None
+        self.dropped_samples = 0
+        self.duplicate_frames = 0
+        self.invalid_lines = 0
+        self.resync_bytes = 0
+
+    def _ensure_capacity(self, n):
+        if n > self.block.shape[1]:
+            self.block = np.empty((self.channels, max(n, 2 * self.block.shape[1])), dtype=np.int16)
+
+    def decode(self, data):
+        data = self.remainder + data
+        raw = np.frombuffer(data, dtype=np.uint8)
+        size = self.frame_size
+        self._ensure_capacity(len(raw) // size)
+
+        count = 0
+        position = 0
+        while len(raw) - position >= size:
+            if raw[position] != SYNC_WORD[0] or raw[position + 1] != SYNC_WORD[1]:
+                next_sync = data.find(SYNC_WORD, position + 1)
+                skip = (next_sync if next_sync >= 0 else len(raw) - 1) - position
+                self.resync_bytes += skip
+                position += skip
+                continue
+
+            n_frames = (len(raw) - position) // size
+            frames = raw[position:position + n_frames * size].reshape(n_frames, size)
+            in_sync = (frames[:, 0] == SYNC_WORD[0]) & (frames[:, 1] == SYNC_WORD[1])
+            if not in_sync.all():
+                n_frames = int(np.argmin(in_sync))
+                frames = frames[:n_frames]
+
+            sequence = frames[:, 2].astype(np.int32) | (frames[:, 3].astype(np.int32) << 8)
+            fresh = self._count_drops(sequence)
+            samples = frames[:, HEADER_SIZE:].view("<u2")
+            if not fresh.all():
+                samples = samples[fresh]
+            self.block[:, count:count + len(samples)] = samples.T
+            count += len(samples)
+            position += n_frames * size
+
+        self.remainder = data[position:]
+        return self.block[:, :count]
+
+    def _count_drops(self, sequence):
+        # Returns a mask of the frames to keep. A repeated sequence number
+        # (gap 0) is a duplicate frame: skipped, and not counted as 0xFFFF
+        # dropped frames.
+        if self.last_sequence is not None:
+            gaps = np.diff(sequence, prepend=self.last_sequence)
+        else:
+            gaps = np.diff(sequence, prepend=sequence[0] - 1)
+        gaps &= 0xFFFF
+        fresh = gaps != 0
+        self.duplicate_frames += len(gaps) - int(np.count_nonzero(fresh))
+        self.dropped_samples += int(np.sum(gaps[fresh] - 1))
+        self.last_sequence = int(sequence[-1])
+        return fresh
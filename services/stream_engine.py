@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity, channels=1, dtype=np.float64):
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.buffer = np.zeros((channels, self.capacity), dtype=dtype)
+        self.total = 0  # absolute index of the next sample to be written
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def write(self, samples):
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples.reshape(1, -1)
+        n = samples.shape[1]
+        if n == 0:
+            return 0
+        if n > self.capacity:
+            samples = samples[:, -self.capacity:]
+            skipped = n - self.capacity
+        else:
+            skipped = 0
+
+        with self.condition:
+            start = (self.total + skipped) % self.capacity
+            count = samples.shape[1]
+            first = min(count, self.capacity - start)
+            self.buffer[:, start:start + first] = samples[:, :first]
+            if first < count:
+                self.buffer[:, :count - first] = samples[:, first:]
+            self.total += n
+            self.condition.notify_all()
+        return n
+
+    def read(self, end, length, out=None):
+        # Copy the samples [end - length, end) in absolute sample indices.
+        if out is None:
+            out = np.empty((self.channels, length), dtype=self.buffer.dtype)
+        with self.condition:
+            if end > self.total or end - length < self.total - self.capacity:
+                raise IndexError("Requested samples are not in the buffer")
+            start = (end - length) % self.capacity
+            first = min(length, self.capacity - start)
+            out[:, :first] = self.buffer[:, start:start + first]
+            if first < length:
+                out[:, first:] = self.buffer[:, :length - first]
+        return out
+
+    def wait_for(self, total, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.total >= total or self.closed, timeout)
+            return self.total >= total
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SlidingWindowEngine:
+    def __init__(self, buffer, window, hop):
+        if hop <= 0 or window <= 0:
+            raise ValueError("Window and hop must be positive")
+        if window > buffer.capacity:
+            raise ValueError("Window does not fit in the ring buffer")
+        self.buffer = buffer
+        self.window = int(window)
+        self.hop = int(hop)
+        self.next_end = self.window
+        self.window_buffer = np.empty((buffer.channels, self.window), dtype=buffer.buffer.dtype)
+        self.windows_emitted = 0
+        self.windows_skipped = 0
+
+    def windows(self, stop_event, timeout=1.0):
+        # Yields one (channels, window) array per hop. Consecutive windows
+        # overlap by window - hop samples, so no sample is ever left out.
+        # Every window is copied into the same array, which is only valid
+        # until the next one is requested.
+        while not stop_event.is_set():
+            if not self.buffer.wait_for(self.next_end, timeout):
+                if self.buffer.closed:
+                    return
+                continue
+
+            oldest_end = self.buffer.total - self.buffer.capacity + self.window
+            if self.next_end < oldest_end:
+                # The consumer fell more than a buffer behind; resume from the
+                # oldest window still available instead of failing.
+                behind = oldest_end - self.next_end
+                hops = -(-behind // self.hop)
+                self.windows_skipped += hops
+                self.next_end += hops * self.hop
+
+            try:
+                window = self.buffer.read(self.next_end, self.window, out=self.window_buffer)
+            except IndexError:
+                continue
+            self.next_end += self.hop
+            self.windows_emitted += 1
+            yield window
+
+    def lag(self):
+        # Samples received but not yet covered by an emitted window.
+        return max(0, self.buffer.total - (self.next_end - self.hop))
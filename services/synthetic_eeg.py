@@ -0,0 +1,102 @@
+import numpy as np
+from scipy import signal
+
+ADC_MIDPOINT = 2048
+ADC_MAX = 4095
+# Values clean_data treats as dropouts (0, or above the 12-bit range)
+DROPOUT_LOW = 0
+DROPOUT_HIGH = 4097
+
+# Burst rates per second for each state in state_to_label order
+# (0 = relaxing, 1 = focused): relaxing shows more alpha, focused more beta
+BURST_RATES = {
+    0: {"alpha": 1.5, "beta": 0.3},
+    1: {"alpha": 0.3, "beta": 1.5},
+}
+BURST_FREQS = {"alpha": (8, 12), "beta": (14, 30)}
+
+
+class SyntheticEEG:
+    # Deterministic EEG-like int16 signal for benchmarks and load tests:
+    # band-limited background noise, alpha/beta bursts depending on the
+    # state, mains interference and single-sample dropouts. Consecutive
+    # calls to generate() continue the same signal.
+    def __init__(self, channels=3, sampling_rate=512, state=0, seed=0, noise_uv=60.0,
+                 burst_uv=120.0, mains_freq=50.0, mains_uv=40.0, dropout_rate=1e-3):
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.state = state
+        self.noise_uv = noise_uv
+        self.burst_uv = burst_uv
+        self.mains_freq = mains_freq
+        self.mains_uv = mains_uv
+        self.dropout_rate = dropout_rate
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+
+        self.noise_sos = signal.butter(4, [1, 40], btype='band', fs=sampling_rate, output='sos')
+        self.noise_zi = np.zeros((self.noise_sos.shape[0], channels, 2))
+        # Scales the filtered noise to noise_uv RMS; white noise keeps about
+        # (40 - 1) / nyquist of its power in the pass band
+        self.noise_gain = noise_uv / np.sqrt((40 - 1) / (sampling_rate / 2))
+        self.mains_phase = self.rng.uniform(0, 2 * np.pi, size=(channels, 1))
+        # Bursts can straddle generate() calls, so the tail is carried over
+        self.carry = np.zeros((channels, 0))
+
+    def add_bursts(self, out):
+        n = out.shape[1]
+        for band, rate in BURST_RATES[self.state].items():
+            low, high = BURST_FREQS[band]
+            for _ in range(self.rng.poisson(rate * n / self.sampling_rate)):
+                channel = self.rng.integers(self.channels)
+                duration = int(self.rng.uniform(0.2, 0.8) * self.sampling_rate)
+                start = self.rng.integers(n)
+                t = np.arange(duration) / self.sampling_rate
+                burst = np.hanning(duration) * np.sin(2 * np.pi * self.rng.uniform(low, high) * t)
+                burst *= self.burst_uv * self.rng.uniform(0.5, 1.0)
+                stop = min(n, start + duration)
+                out[channel, start:stop] += burst[:stop - start]
+                if start + duration > n:
+                    self.carry_over(channel, burst[stop - start:])
+
+    def carry_over(self, channel, tail):
+        if tail.shape[0] > self.carry.shape[1]:
+            carry = np.zeros((self.channels, tail.shape[0]))
+            carry[:, :self.carry.shape[1]] = self.carry
+            self.carry = carry
+        self.carry[channel, :tail.shape[0]] += tail
+
+    def generate(self, n_samples):
+        noise = self.rng.standard_normal((self.channels, n_samples))
+        out, self.noise_zi = signal.sosfilt(self.noise_sos, noise, axis=-1, zi=self.noise_zi)
+        out *= self.noise_gain
+
+        carried = min(n_samples, self.carry.shape[1])
+        out[:, :carried] += self.carry[:, :carried]
+        self.carry = self.carry[:, carried:]
+        self.add_bursts(out)
+
+        t = (self.position + np.arange(n_samples)) / self.sampling_rate
+        out += self.mains_uv * np.sin(2 * np.pi * self.mains_freq * t + self.mains_phase)
+        self.position += n_samples
+
+        samples = np.clip(np.rint(out + ADC_MIDPOINT), 1, ADC_MAX).astype(np.int16)
+        dropouts = self.rng.random(samples.shape) < self.dropout_rate
+        samples[dropouts] = np.where(self.rng.random(int(dropouts.sum())) < 0.5, DROPOUT_LOW, DROPOUT_HIGH)
+        return samples
+
+    def windows(self, n_windows, window):
+        # (n_windows, channels, window) consecutive, non-overlapping windows
+        data = self.generate(n_windows * window)
+        return data.reshape(self.channels, n_windows, window).transpose(1, 0, 2).copy()
+
+
+def labelled_windows(n_windows, window, channels=3, sampling_rate=512, seed=0):
+    # Equal numbers of relaxing and focused windows, e.g. to fit a model
+    windows = []
+    labels = []
+    for state in (0, 1):
+        generator = SyntheticEEG(channels, sampling_rate, state=state, seed=seed + state)
+        windows.append(generator.windows(n_windows // 2, window))
+        labels.append(np.full(n_windows // 2, state))
+    return np.concatenate(windows), np.concatenate(labels)
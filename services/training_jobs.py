@@ -0,0 +1,139 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from utils.metrics import registry
+
+TRAINING_WORKERS = int(os.environ.get("TRAINING_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+TRAINING_MAX_PENDING = int(os.environ.get("TRAINING_MAX_PENDING", 16))
+
+
+def run_job(target, args):
+    # Runs in the worker process; reports its own start and end times since
+    # the parent only learns about the job when it finishes.
+    started_at = time.time()
+    result = target(*args)
+    return {"started_at": started_at, "finished_at": time.time(), "result": result}
+
+
+class TrainingJob:
+    def __init__(self, email):
+        self.email = email
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        if self.status == "queued" and self.future is not None and self.future.running():
+            # Handed to a worker process; the exact start time arrives with
+            # the result
+            status = "running"
+        else:
+            status = self.status
+        now = time.time()
+        if self.started_at:
+            queue_seconds = self.started_at - self.submitted_at
+        elif status == "queued":
+            queue_seconds = now - self.submitted_at
+        else:
+            queue_seconds = None
+        return {
+            "email": self.email,
+            "status": status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": queue_seconds,
+            "run_seconds": (self.finished_at or now) - self.started_at if self.started_at else None,
+            "error": self.error,
+        }
+
+
+class TrainingScheduler:
+    # Bounded queue of training jobs executed in a process pool, with at
+    # most one queued or running job per user.
+    def __init__(self, max_workers=TRAINING_WORKERS, max_pending=TRAINING_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        if self.executor is None:
+            # spawn keeps the parent's MongoClient and threads out of workers
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def submit(self, email, target, *args, on_done=None):
+        # Returns (job, created). An active job for the same user is returned
+        # instead of starting another; (None, False) means the queue is full.
+        with self.lock:
+            job = self.jobs.get(email)
+            if job is not None and job.active:
+                return job, False
+            if sum(1 for job in self.jobs.values() if job.active) >= self.max_pending:
+                return None, False
+
+            job = TrainingJob(email)
+            self.jobs[email] = job
+            try:
+                job.future = self.get_executor().submit(run_job, target, args)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool
+                self.executor = None
+                job.future = self.get_executor().submit(run_job, target, args)
+        job.future.add_done_callback(lambda future: self.finished(job, future, on_done))
+        return job, True
+
+    def finished(self, job, future, on_done):
+        job.finished_at = time.time()
+        try:
+            outcome = future.result()
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+        else:
+            job.started_at = outcome["started_at"]
+            job.finished_at = outcome["finished_at"]
+            job.result = outcome["result"]
+            if isinstance(job.result, dict) and job.result.get("status") == "error":
+                job.status = "failed"
+                job.error = job.result.get("message")
+            else:
+                job.status = "done"
+        if on_done:
+            on_done(job)
+
+    def status(self, email):
+        with self.lock:
+            job = self.jobs.get(email)
+        return job.to_dict() if job else None
+
+    def counts(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for job in jobs:
+            counts[job.to_dict()["status"]] += 1
+        return counts
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+training_scheduler = TrainingScheduler()
+registry.gauge("bci_training_jobs", "Latest training job of each user by status",
+               lambda: [({"status": status}, count) for status, count in training_scheduler.counts().items()])
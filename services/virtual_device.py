@@ -0,0 +1,338 @@
+import os
+import sys
+import time
+import select
+import socket
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from .serial_decoder import SYNC_WORD
+from .synthetic_eeg import SyntheticEEG
+from .raw_archive import RawSessionReader
+
+VIRTUAL_DEVICE_CHUNK = int(os.environ.get("VIRTUAL_DEVICE_CHUNK", 16))  # samples per write
+
+# Stand-in for the Wifi_Communication.ino sketch: answers the same
+# commands (start_reading, stop_reading, binary_mode, text_mode) and streams
+# samples in the same text or binary format, paced at the sampling rate
+# times `speed` (0 streams as fast as the reader accepts). Headsets are
+# exposed as ptys, which SensorReader opens like a real serial port, or
+# over TCP with one headset per connection, e.g.
+#   python -m services.virtual_device --pty 16 --source synthetic
+#   python -m services.virtual_device --tcp 7000 --source recordings/user@example.com/<session_id>
+
+
+def encode_text(block):
+    # Serial.print/println output ("v0,v1,v2\r\n" per sample) without a
+    # Python loop over samples
+    values = np.asarray(block, dtype=np.int64).T
+    digits = 1 + (values >= 10) + (values >= 100) + (values >= 1000) + (values >= 10000)
+    separators = np.ones_like(values)
+    separators[:, -1] = 2
+    widths = (digits + separators).ravel()
+    ends = np.cumsum(widths)
+    starts = ends - widths
+    values = values.ravel()
+    digits = digits.ravel()
+
+    out = np.empty(ends[-1] if len(ends) else 0, dtype=np.uint8)
+    for k in range(5):
+        has_digit = digits > k
+        out[(starts + digits - 1 - k)[has_digit]] = ord("0") + (values[has_digit] // 10 ** k) % 10
+    line_end = (separators == 2).ravel()
+    out[(starts + digits)[~line_end]] = ord(",")
+    out[(starts + digits)[line_end]] = ord("\r")
+    out[(starts + digits + 1)[line_end]] = ord("\n")
+    return out.tobytes()
+
+
+def encode_binary(block, sequence):
+    channels, n = block.shape
+    frames = np.empty((n, 2 + channels), dtype="<u2")
+    frames[:, 0] = int.from_bytes(SYNC_WORD, "little")
+    frames[:, 1] = (sequence + np.arange(n)) & 0xFFFF
+    frames[:, 2:] = block.T
+    return frames.tobytes()
+
+
+class ArraySource:
+    # Replays a (channels, samples) recording in a loop
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.int16)
+        self.channels = self.data.shape[0]
+        self.n_samples = self.data.shape[1]
+        self.position = 0
+
+    def read(self, start, stop):
+        return self.data[:, start:stop]
+
+    def generate(self, n_samples):
+        out = np.empty((self.channels, n_samples), dtype=np.int16)
+        count = 0
+        while count < n_samples:
+            n = min(n_samples - count, self.n_samples - self.position)
+            out[:, count:count + n] = self.read(self.position, self.position + n)
+            count += n
+            self.position = (self.position + n) % self.n_samples
+        return out
+
+
+class ArchiveSource(ArraySource):
+    # Replays a raw archive session chunk by chunk instead of loading it
+    def __init__(self, path):
+        self.reader = RawSessionReader(path)
+        self.channels = self.reader.channels
+        self.n_samples = self.reader.n_samples
+        self.position = 0
+        if not self.n_samples:
+            raise ValueError(f"{path} contains no samples")
+
+    def read(self, start, stop):
+        return self.reader.read(start, stop)
+
+
+def load_csv(path):
+    # CSVs written by eeg_collect (eeg_data_0, eeg_data_1, ...) or the older
+    # single column eeg_data files
+    df = pd.read_csv(path)
+    columns = [column for column in df.columns if str(column).startswith("eeg_data")] or list(df.columns)
+    return df[columns].to_numpy(dtype=np.int16).T
+
+
+def open_source(spec, channels, sampling_rate=512, seed=0):
+    # "synthetic", "synthetic:<state>", a CSV file or a raw archive session
+    if spec.startswith("synthetic"):
+        state = int(spec.partition(":")[2] or 0)
+        return SyntheticEEG(channels, sampling_rate, state=state, seed=seed)
+    if os.path.isdir(spec):
+        source = ArchiveSource(spec)
+    else:
+        source = ArraySource(load_csv(spec))
+    if source.channels < channels:
+        raise ValueError(f"{spec} has {source.channels} channels, {channels} requested")
+    return source
+
+
+class PtyTransport:
+    def __init__(self):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+
+    def fileno(self):
+        return self.master
+
+    def recv(self, size):
+        try:
+            return os.read(self.master, size)
+        except OSError:
+            return b""
+
+    def sendall(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.master, view):]
+
+    def close(self):
+        # The slave end stays open while serving, so readers can disconnect
+        # and reconnect without the master seeing end of file
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class VirtualHeadset:
+    def __init__(self, source, channels=3, sampling_rate=512, speed=1.0, chunk=VIRTUAL_DEVICE_CHUNK):
+        self.source = source
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.speed = speed
+        self.chunk = chunk
+        self.reading = False
+        self.binary = False
+        self.sequence = 0
+        self.clock_start = 0.0
+        self.clock_samples = 0
+
+        self.samples_sent = 0
+        self.bytes_sent = 0
+        self.max_lag_seconds = 0.0
+
+    def handle_command(self, command):
+        if command == "start_reading":
+            self.reading = True
+            self.clock_start = time.monotonic()
+            self.clock_samples = 0
+        elif command == "stop_reading":
+            self.reading = False
+        elif command == "binary_mode":
+            self.binary = True
+            self.sequence = 0
+        elif command == "text_mode":
+            self.binary = False
+
+    def due_samples(self):
+        if self.speed <= 0:
+            return self.sampling_rate
+        elapsed = time.monotonic() - self.clock_start
+        return int(elapsed * self.sampling_rate * self.speed) - self.clock_samples
+
+    def wait_time(self):
+        if not self.reading:
+            return 0.5
+        if self.speed <= 0:
+            return 0
+        next_chunk = self.clock_start + (self.clock_samples + self.chunk) / (self.sampling_rate * self.speed)
+        return max(0.0, next_chunk - time.monotonic())
+
+    def send(self, transport):
+        due = self.due_samples()
+        if due < min(self.chunk, self.sampling_rate):
+            return
+        if self.speed > 0:
+            # Samples owed beyond one chunk mean the reader (or this process)
+            # fell behind real time
+            lag = (due - self.chunk) / (self.sampling_rate * self.speed)
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+        block = self.source.generate(due)[:self.channels]
+        if self.binary:
+            data = encode_binary(block, self.sequence)
+            self.sequence = (self.sequence + due) & 0xFFFF
+        else:
+            data = encode_text(block)
+        transport.sendall(data)
+        self.clock_samples += due
+        self.samples_sent += due
+        self.bytes_sent += len(data)
+
+    def serve(self, transport, stop_event):
+        pending = b""
+        while not stop_event.is_set():
+            ready, _, _ = select.select([transport], [], [], self.wait_time())
+            if ready:
+                data = transport.recv(1024)
+                if not data:
+                    break
+                pending += data
+                while b"\n" in pending:
+                    line, _, pending = pending.partition(b"\n")
+                    self.handle_command(line.strip().decode(errors="ignore"))
+            if self.reading:
+                try:
+                    self.send(transport)
+                except OSError:
+                    break
+
+    def stats(self):
+        return {
+            "reading": self.reading,
+            "binary": self.binary,
+            "samples_sent": self.samples_sent,
+            "bytes_sent": self.bytes_sent,
+            "max_lag_seconds": self.max_lag_seconds,
+        }
+
+
+class VirtualDevice:
+    # A set of virtual headsets, each served by its own thread
+    def __init__(self, source_factory, channels=3, sampling_rate=512, speed=1.0):
+        self.source_factory = source_factory
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.speed = speed
+        self.stop_event = threading.Event()
+        self.headsets = []
+        self.threads = []
+        self.transports = []
+        self.server = None
+
+    def new_headset(self):
+        headset = VirtualHeadset(self.source_factory(len(self.headsets)), self.channels,
+                                 self.sampling_rate, self.speed)
+        self.headsets.append(headset)
+        return headset
+
+    def serve(self, headset, transport):
+        thread = threading.Thread(target=headset.serve, args=(transport, self.stop_event),
+                                  name=f"virtual-headset-{len(self.threads)}", daemon=True)
+        self.threads.append(thread)
+        self.transports.append(transport)
+        thread.start()
+
+    def open_pty(self):
+        transport = PtyTransport()
+        self.serve(self.new_headset(), transport)
+        return transport.name
+
+    def listen_tcp(self, host="127.0.0.1", port=7000):
+        self.server = socket.create_server((host, port))
+        threading.Thread(target=self.accept, name="virtual-device-accept", daemon=True).start()
+        return self.server.getsockname()
+
+    def accept(self):
+        while not self.stop_event.is_set():
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"Virtual headset {len(self.headsets)} connected from {address[0]}:{address[1]}")
+            self.serve(self.new_headset(), connection)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        for transport in self.transports:
+            transport.close()
+
+    def stats(self):
+        headsets = [headset.stats() for headset in self.headsets]
+        return {
+            "headsets": len(headsets),
+            "reading": sum(1 for stats in headsets if stats["reading"]),
+            "samples_sent": sum(stats["samples_sent"] for stats in headsets),
+            "max_lag_seconds": max((stats["max_lag_seconds"] for stats in headsets), default=0.0),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pty", type=int, default=0, help="number of pty headsets to create")
+    parser.add_argument("--tcp", type=int, help="serve one headset per TCP connection on this port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--source", default="synthetic",
+                        help="synthetic, synthetic:<state>, a CSV file or a raw archive session directory")
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--sampling-rate", type=int, default=512)
+    parser.add_argument("--speed", type=float, default=1.0, help="1 is real time, 0 as fast as possible")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    args = parser.parse_args()
+    if not args.pty and args.tcp is None:
+        parser.error("use --pty and/or --tcp")
+
+    # Each headset gets its own source, so synthetic headsets differ
+    device = VirtualDevice(lambda i: open_source(args.source, args.channels, args.sampling_rate, args.seed + i),
+                           args.channels, args.sampling_rate, args.speed)
+    for i in range(args.pty):
+        print(f"Virtual headset {i}: {device.open_pty()}", flush=True)
+    if args.tcp is not None:
+        host, port = device.listen_tcp(args.host, args.tcp)
+        print(f"Virtual device listening on socket://{host}:{port}", flush=True)
+
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print(f"Virtual device: {device.stats()}", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.stop()
+
+
+if __name__ == "__main__":
+    main()
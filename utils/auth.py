@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import jwt
+from fastapi import Depends, Request
+from utils.hash_helper import SECRET_KEY, ALGORITHM
+from database import users_repository
+from utils.metrics import registry
+
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 60))  # seconds
+AUTH_CACHE_ENTRIES = int(os.environ.get("AUTH_CACHE_ENTRIES", 4096))
+
+# The part of the user document protected routes look at
+USER_STATE_PROJECTION = {
+    "_id": 0,
+    "email": 1,
+    "model_trained": 1,
+    "focused_data_collected": 1,
+    "relaxed_data_collected": 1,
+}
+
+
+class AuthError(Exception):
+    # Turned into {"status": "error", "message": ...} by the handler in main
+    def __init__(self, message="Invalid token"):
+        super().__init__(message)
+        self.message = message
+
+
+class AuthCache:
+    # Verified tokens and projected user state, so polling endpoints skip
+    # the JWT verification and the database round trip. Tokens are kept
+    # until they expire or the TTL passes; user state is dropped whenever
+    # the user document is written through users_repository (and on the
+    # explicit invalidate calls for writes that bypass it).
+    def __init__(self, ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.tokens = OrderedDict()
+        self.users = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, entries, key):
+        with self.lock:
+            entry = entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, entries, key, value, ttl):
+        with self.lock:
+            entries[key] = (value, time.monotonic() + ttl)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def verify(self, token):
+        if not token:
+            raise AuthError()
+        email = self._get(self.tokens, token)
+        if email is not None:
+            return email
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            raise AuthError()
+        email = payload.get("email")
+        if not email:
+            raise AuthError()
+        ttl = self.ttl
+        if payload.get("exp"):
+            ttl = min(ttl, payload["exp"] - time.time())
+        self._put(self.tokens, token, email, ttl)
+        return email
+
+    async def user(self, email):
+        user = self._get(self.users, email)
+        if user is not None:
+            return user
+        with self.lock:
+            version = self.versions.get(email, 0)
+        user = await users_repository.find_by_email(email, USER_STATE_PROJECTION)
+        with self.lock:
+            # A write during the query would otherwise be cached over
+            stale = self.versions.get(email, 0) != version
+        if user is not None and not stale:
+            self._put(self.users, email, user, self.ttl)
+        return user
+
+    def invalidate(self, email):
+        with self.lock:
+            self.users.pop(email, None)
+            self.versions[email] = self.versions.get(email, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"tokens": len(self.tokens), "users": len(self.users), "hits": self.hits, "misses": self.misses}
+
+
+auth_cache = AuthCache()
+users_repository.listeners.append(auth_cache.invalidate)
+registry.gauge("bci_auth_cache_hits_total", "Token and user lookups served from the auth cache",
+               lambda: auth_cache.stats()["hits"], kind="counter")
+registry.gauge("bci_auth_cache_misses_total", "Token and user lookups that missed the auth cache",
+               lambda: auth_cache.stats()["misses"], kind="counter")
+
+
+async def current_email(request: Request):
+    return auth_cache.verify(request.cookies.get("access_token"))
+
+
+async def current_user(email: str = Depends(current_email)):
+    user = await auth_cache.user(email)
+    if not user:
+        raise AuthError("User not found")
+    return user
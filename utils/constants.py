@@ -1,3 +1,5 @@
+import os
+
 state_to_label = {
     "Relaxing":0,
     "Focused":1
@@ -6,4 +8,13 @@ state_to_label = {
 state_to_database = {
     "Focused":"focused_data_collected",
     "Relaxing":"relaxed_data_collected",
-}
\ No newline at end of file
+}
+
+COM_PORT = os.environ.get("COM_PORT")
+# Comma separated ports users may pick with ?port= (e.g.
+# EEG_PORTS=/dev/ttyUSB0,/dev/ttyUSB1); anything else is refused, since
+# SensorReader would open any device node or socket:// URL it is given
+EEG_PORTS = [port.strip() for port in os.environ.get("EEG_PORTS", COM_PORT or "").split(",") if port.strip()]
+EEG_CHANNELS = int(os.environ.get("EEG_CHANNELS", 3))
+EEG_BINARY_FRAMES = os.environ.get("EEG_BINARY_FRAMES", "0") == "1"
+MODEL_DIR = os.environ.get("MODEL_DIR", "models")
@@ -1,7 +1,11 @@
 import jwt
-from passlib.context import CryptContext
+import bcrypt
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from utils.metrics import registry
 import os
 import math
 import random
@@ -11,7 +15,19 @@ load_dotenv()
 SECRET_KEY = os.environ.get("JWT_SECRET")
 ALGORITHM = "HS256"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cost factor for new hashes; stored hashes with another cost are rehashed
+# on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+
+# bcrypt releases the GIL while hashing, so a thread pool spreads hashes
+# over the cores and keeps them off the event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_slots = None
+password_queue_seconds = registry.histogram("bci_password_hash_queue_seconds",
+                                            "Time password hashes waited for a worker", ("operation",))
+password_hash_seconds = registry.histogram("bci_password_hash_seconds", "Time spent hashing passwords",
+                                           ("operation",))
 
 
 def create_access_token(data: dict, expires_delta:timedelta = timedelta(days=1)):
@@ -21,11 +37,57 @@ def create_access_token(data: dict, expires_delta:timedelta = timedelta(days=1))
     encoded_jwt = jwt.encode(to_encode,SECRET_KEY,algorithm=ALGORITHM)
     return encoded_jwt
 
+def encode_password(password: str):
+    # bcrypt only uses the first 72 bytes; passlib truncated silently too
+    return password.encode()[:72]
+
 def hash_password(password: str):
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(encode_password(password), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return bcrypt.checkpw(encode_password(plain_password), hashed_password.encode())
+    except ValueError:
+        return False
+
+def needs_rehash(hashed_password):
+    # "$2b$12$<salt and checksum>"
+    parts = hashed_password.split("$")
+    return len(parts) < 4 or parts[1] != "2b" or int(parts[2]) != BCRYPT_ROUNDS
+
+def verify_and_update(plain_password, hashed_password):
+    # Returns (valid, new_hash); new_hash is set when the stored hash should
+    # be replaced
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, hash_password(plain_password)
+    return True, None
+
+async def run_password_job(operation, function, *args):
+    global password_slots
+    if password_slots is None:
+        password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+    submitted = time.perf_counter()
+
+    def job():
+        started = time.perf_counter()
+        password_queue_seconds.observe(started - submitted, operation=operation)
+        try:
+            return function(*args)
+        finally:
+            password_hash_seconds.observe(time.perf_counter() - started, operation=operation)
+
+    # Requests beyond the worker count wait here, on the event loop, rather
+    # than piling up in the executor
+    async with password_slots:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, job)
+
+async def hash_password_async(password: str):
+    return await run_password_job("hash", hash_password, password)
+
+async def verify_and_update_async(plain_password, hashed_password):
+    return await run_password_job("verify", verify_and_update, plain_password, hashed_password)
 
 def decode_token(token):
     try:
@@ -0,0 +1,210 @@
+import os
+import math
+import bisect
+import threading
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+# Seconds; covers sub-millisecond feature extraction up to blocking serial reads
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Minimal Prometheus client: counters, histograms and scrape-time gauges,
+# rendered in the text exposition format by /metrics. With METRICS_ENABLED=0
+# recording returns immediately, so instrumented loops only pay for the
+# perf_counter calls around each stage.
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, **labels):
+        # Look the child up once and keep it, instead of on every observation
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.new_child())
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self):
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in children:
+            yield dict(zip(self.labelnames, key)), child
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if not METRICS_ENABLED or not amount:
+            return
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1, **labels):
+        self.labels(**labels).inc(amount)
+
+    def render(self):
+        lines = self.header()
+        for labels, child in self.samples():
+            lines.append(f"{self.name}{format_labels(labels)} {format_value(child.value)}")
+        return lines
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.upper_bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        if not METRICS_ENABLED:
+            return
+        i = bisect.bisect_left(self.upper_bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def render(self):
+        lines = self.header()
+        for labels, child in self.samples():
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = format_labels({**labels, "le": format_value(upper_bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class CallbackGauge(Metric):
+    # Read at scrape time; callback returns a number or a list of
+    # (labels dict, value) pairs. kind="counter" exposes running totals kept
+    # elsewhere (e.g. cache hits).
+    def __init__(self, name, documentation, callback, kind="gauge"):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        lines = self.header()
+        values = self.callback()
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            lines.append(f"{self.name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, kind="gauge"):
+        return self.register(CallbackGauge(name, documentation, callback, kind))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Failed to collect {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Pipeline metrics shared by prediction sessions, data collection and batch
+# scoring; the pipeline label is "prediction", "collection" or "scoring".
+stage_seconds = registry.histogram("bci_stage_seconds", "Time spent in each pipeline stage",
+                                   ("pipeline", "stage"))
+samples_total = registry.counter("bci_samples_total", "EEG samples received from headsets", ("pipeline",))
+dropped_samples_total = registry.counter("bci_dropped_samples_total",
+                                         "Samples lost in transmission (binary frame sequence gaps)", ("pipeline",))
+interpolated_samples_total = registry.counter("bci_interpolated_samples_total",
+                                              "Dropout samples replaced by interpolation", ("pipeline",))
+invalid_lines_total = registry.counter("bci_invalid_lines_total", "Malformed serial lines or frames discarded",
+                                       ("pipeline",))
+windows_total = registry.counter("bci_windows_total", "Windows turned into features", ("pipeline",))
+windows_skipped_total = registry.counter("bci_windows_skipped_total",
+                                         "Prediction windows skipped to catch up with real time")
+
+
+def record_device_counters(pipeline, sensor_reader, preprocessor, reported):
+    # The decoder and preprocessor keep running totals per device; forwards
+    # what was added since the previous call (reported holds those totals)
+    current = {
+        "dropped": sensor_reader.dropped_samples,
+        "invalid": sensor_reader.decoder.invalid_lines,
+        "interpolated": preprocessor.interpolated_samples,
+    }
+    dropped_samples_total.labels(pipeline=pipeline).inc(current["dropped"] - reported.get("dropped", 0))
+    invalid_lines_total.labels(pipeline=pipeline).inc(current["invalid"] - reported.get("invalid", 0))
+    interpolated_samples_total.labels(pipeline=pipeline).inc(current["interpolated"] - reported.get("interpolated", 0))
+    reported.update(current)
@@ -1,5 +1,9 @@
-from fastapi_mail import FastMail, MessageSchema,ConnectionConfig
+import asyncio
+import time
+from email.message import EmailMessage
+import aiosmtplib
 from dotenv import load_dotenv
+from utils.metrics import registry
 import os
 
 load_dotenv()
@@ -7,36 +11,185 @@ load_dotenv()
 EMAIL: str = os.environ.get("MAIL_EMAIL")
 PASSWORD: str = os.environ.get("MAIL_PASSWORD")
 
-connection_conf = ConnectionConfig(
-    MAIL_USERNAME=EMAIL,
-    MAIL_PASSWORD=PASSWORD,
-    MAIL_FROM=EMAIL,
-    MAIL_PORT=587,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True
-)
+# Defaults are Gmail's submission port; for local testing run a debugging
+# server (python -m aiosmtpd -n -l localhost:1025) and set
+# MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_STARTTLS=0 MAIL_USE_CREDENTIALS=0
+MAIL_SERVER = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.environ.get("MAIL_PORT", 587))
+MAIL_STARTTLS = os.environ.get("MAIL_STARTTLS", "1") == "1"
+MAIL_SSL_TLS = os.environ.get("MAIL_SSL_TLS", "0") == "1"
+MAIL_USE_CREDENTIALS = os.environ.get("MAIL_USE_CREDENTIALS", "1") == "1"
+MAIL_VALIDATE_CERTS = os.environ.get("MAIL_VALIDATE_CERTS", "1") == "1"
+MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE", 1000))
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 20))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 4))
+MAIL_RETRY_DELAY = float(os.environ.get("MAIL_RETRY_DELAY", 2.0))  # seconds, doubled per attempt
+MAIL_IDLE_TIMEOUT = float(os.environ.get("MAIL_IDLE_TIMEOUT", 60.0))  # seconds before the connection is closed
 
-async def send_email(email: str, subject: str, message: str):
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email],
-        body=message,
-        subtype="html"
-    )
-
-    fm = FastMail(connection_conf)
-    
-    try:
-        await fm.send_message(message)
+
+class OutgoingEmail:
+    def __init__(self, recipient, subject, html):
+        self.message = EmailMessage()
+        self.message["From"] = EMAIL
+        self.message["To"] = recipient
+        self.message["Subject"] = subject
+        self.message.set_content(html, subtype="html")
+        self.attempts = 0
+
+
+class EmailDispatcher:
+    # Queues emails in-process and sends them from one background task over
+    # a single SMTP connection that is kept open between messages and
+    # closed after MAIL_IDLE_TIMEOUT without traffic. Whatever is waiting
+    # when the worker wakes up is sent as one batch on that connection;
+    # failed messages are retried with exponential backoff.
+    def __init__(self, queue_size=MAIL_QUEUE_SIZE, batch_size=MAIL_BATCH_SIZE, max_attempts=MAIL_MAX_ATTEMPTS,
+                 retry_delay=MAIL_RETRY_DELAY, idle_timeout=MAIL_IDLE_TIMEOUT):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.queue = None
+        self.worker = None
+        self.smtp = None
+        self.retries = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.connections = 0
+
+    def start(self):
+        # Must run on the event loop that serves the requests
+        if self.worker is None or self.worker.done():
+            if self.queue is None:
+                self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.worker = asyncio.create_task(self.run())
+
+    def enqueue(self, recipient, subject, html):
+        # Returns False when the queue is full
+        self.start()
+        try:
+            self.queue.put_nowait(OutgoingEmail(recipient, subject, html))
+        except asyncio.QueueFull:
+            return False
         return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
-    
 
+    async def run(self):
+        while True:
+            try:
+                email = await asyncio.wait_for(self.queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                await self.disconnect()
+                continue
+            batch = [email]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self.send_batch(batch)
+
+    async def connect(self):
+        if self.smtp is not None and self.smtp.is_connected:
+            return self.smtp
+        self.smtp = None
+        smtp = aiosmtplib.SMTP(hostname=MAIL_SERVER, port=MAIL_PORT, use_tls=MAIL_SSL_TLS,
+                               start_tls=MAIL_STARTTLS, validate_certs=MAIL_VALIDATE_CERTS)
+        try:
+            await smtp.connect()
+            if MAIL_USE_CREDENTIALS:
+                await smtp.login(EMAIL, PASSWORD)
+        except BaseException:
+            # Only kept once logged in; a connected but unauthenticated
+            # client would fail every later send
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.connections += 1
+        return self.smtp
+
+    async def disconnect(self):
+        if self.smtp is None:
+            return
+        try:
+            if self.smtp.is_connected:
+                await self.smtp.quit()
+        except aiosmtplib.SMTPException:
+            self.smtp.close()
+        self.smtp = None
 
-    
-    
\ No newline at end of file
+    async def send_batch(self, batch):
+        for i, email in enumerate(batch):
+            email.attempts += 1
+            try:
+                smtp = await self.connect()
+                await smtp.send_message(email.message)
+                self.sent += 1
+            except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPResponseException) as e:
+                # The server answered; the connection stays usable. 5xx
+                # replies (e.g. unknown recipient) are not worth retrying.
+                print(f"Error sending email to {email.message['To']} (attempt {email.attempts}): {e}")
+                if getattr(e, "code", 500) >= 500:
+                    self.failed += 1
+                else:
+                    self.retry(email)
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                print(f"Error sending email to {email.message['To']} (attempt {email.attempts}): {e}")
+                # The connection may be unusable; the next message reconnects
+                await self.disconnect()
+                self.retry(email)
+                if isinstance(e, (aiosmtplib.SMTPConnectError, OSError)):
+                    # The server is unreachable; the rest of the batch would
+                    # fail the same way
+                    for remaining in batch[i + 1:]:
+                        self.retry(remaining)
+                    return
+
+    def retry(self, email):
+        if email.attempts >= self.max_attempts:
+            self.failed += 1
+            print(f"Giving up on email to {email.message['To']} after {email.attempts} attempts")
+            return
+        self.retried += 1
+        task = asyncio.create_task(self.requeue(email, self.retry_delay * 2 ** (email.attempts - 1)))
+        self.retries.add(task)
+        task.add_done_callback(self.retries.discard)
+
+    async def requeue(self, email, delay):
+        await asyncio.sleep(delay)
+        try:
+            self.queue.put_nowait(email)
+        except asyncio.QueueFull:
+            self.failed += 1
+
+    async def close(self, timeout=5):
+        # Gives queued messages a chance to go out before shutting down
+        if self.worker is None:
+            return
+        deadline = time.monotonic() + timeout
+        while not self.queue.empty() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.worker.cancel()
+        for task in list(self.retries):
+            task.cancel()
+        await self.disconnect()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "connections": self.connections,
+        }
+
+
+email_dispatcher = EmailDispatcher()
+registry.gauge("bci_email_queue", "Emails waiting to be sent", lambda: email_dispatcher.stats()["queued"])
+registry.gauge("bci_emails_total", "Emails by outcome",
+               lambda: [({"result": key}, email_dispatcher.stats()[key]) for key in ("sent", "failed", "retried")],
+               kind="counter")
+
+
+async def send_email(email: str, subject: str, message: str):
+    # Queues the email and returns without waiting for the SMTP server
+    return email_dispatcher.enqueue(email, subject, message)
@@ -1,4 +1,5 @@
-import math,random
+import math,random,os
+from utils.constants import MODEL_DIR
 
 
 def generate_otp(length=6):
@@ -7,3 +8,17 @@ def generate_otp(length=6):
     for i in range(length):
         otp += digits[math.floor(random.random() * 10)]
     return otp
+
+def model_paths(email):
+    return os.path.join(MODEL_DIR, f"{email}.pkl"), os.path.join(MODEL_DIR, f"{email}_scaler.pkl")
+
+def artifact_manifest_path(email):
+    return os.path.join(MODEL_DIR, f"{email}.model.json")
+
+def model_files(email):
+    # The files a user's model is loaded from: the artifact manifest, or
+    # the pickles of models saved before artifacts existed
+    manifest_path = artifact_manifest_path(email)
+    if os.path.exists(manifest_path):
+        return (manifest_path,)
+    return model_paths(email)